@@ -0,0 +1,356 @@
+"""
+Measure the console and resource code on synthetic workloads, and print
+the results as JSON, for tracking performance across releases:
+
+	python Benchmark.py [--lines N] [--history M] [--icons K]
+		[--paths P] [--widgets W] [--script-lines S] [--only NAME ...]
+
+Each benchmark reports times in seconds. The report also holds the
+process's peak memory use, where the platform reports it.
+
+The widgets are driven through their signals and key events, as a user
+would drive them. Qt 5 and later are told to use the offscreen
+platform; under Qt 4 on X11, run this under a virtual display such as
+Xvfb.
+"""
+
+import argparse, json, os, shutil, subprocess, sys, tempfile, time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from Manifest import QtCore, QtGui
+import ResourceManager, Settings
+from MagicCommands import GetPeakMemoryKiB
+from HistoryStore import HistoryStore
+from InteractivePythonWidget import InteractivePythonWidget, \
+	PythonInputWidget
+
+ICON_SIZE = 16
+COMPLETION_REPEATS = 100
+IMPORT_REPEATS = 5
+KEYSTROKE_REPEATS = 200
+
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, %r)
+start = time.time()
+import %s as package
+package.%s
+sys.stdout.write('%%r %%d' %% (time.time() - start, len(sys.modules)))
+"""
+"""measures importing the package and then using one of its names"""
+
+
+
+def _Time(function, *args):
+	"""Return the wall time taken by function(*args)."""
+	start = time.time()
+	function(*args)
+	return time.time() - start
+
+
+def _ProcessEvents():
+	QtGui.QApplication.processEvents()
+
+
+def _PressKey(widget, key, modifiers=QtCore.Qt.NoModifier, text=''):
+	for eventType in (QtCore.QEvent.KeyPress, QtCore.QEvent.KeyRelease):
+		QtGui.QApplication.sendEvent(widget,
+			QtGui.QKeyEvent(eventType, key, modifiers, text))
+
+
+def _MakeConsole(namespace=None):
+	widget = InteractivePythonWidget(locals=namespace or {})
+	inputField = widget.findChildren(PythonInputWidget)[0]
+	return widget, inputField
+
+
+def _Execute(inputField, sourceText):
+	"""Type sourceText into inputField and execute it with Ctrl+Return."""
+	inputField.setPlainText(sourceText)
+	_PressKey(inputField, QtCore.Qt.Key_Return,
+		QtCore.Qt.ControlModifier)
+	_ProcessEvents()
+
+
+
+def BenchmarkOutput(options, workDir):
+	"""Print options.lines lines, statement by statement and as a script."""
+	widget, inputField = _MakeConsole()
+	sourceText = 'for i in xrange(%d):\n\tprint("%%d %s" %% i)\n' \
+		% (options.lines, 'x'*60)
+	results = {
+		'printLines': _Time(_Execute, inputField, sourceText),
+	}
+
+	def executeScript():
+		inputField.setPlainText(sourceText)
+		_PressKey(inputField, QtCore.Qt.Key_Return,
+			QtCore.Qt.ShiftModifier)
+		_ProcessEvents()
+	results['printLinesAsScript'] = _Time(executeScript)
+
+	statements = '\n'.join(['x%d = %d' % (i, i)
+		for i in xrange(options.lines/10)])
+	results['runStatements'] = _Time(_Execute, inputField, statements)
+	results['rerunStatements'] = _Time(_Execute, inputField, statements)
+	widget.deleteLater()
+	return results
+
+
+def BenchmarkCompletion(options, workDir):
+	"""Complete names in a namespace of options.history names."""
+	namespace = dict([('name%d' % i, i)
+		for i in xrange(options.history)])
+	namespace['os'] = os
+	widget, inputField = _MakeConsole(namespace)
+	results = {}
+	for name, text in (('completeName', 'name1'),
+	('completeAttribute', 'os.pa')):
+		start = time.time()
+		for i in xrange(COMPLETION_REPEATS):
+			inputField.setPlainText(text)
+			inputField.moveCursor(QtGui.QTextCursor.End)
+			_PressKey(inputField, QtCore.Qt.Key_Tab)
+		results[name] = (time.time() - start)/COMPLETION_REPEATS
+	widget.deleteLater()
+	return results
+
+
+def BenchmarkHistory(options, workDir):
+	"""Load options.history history entries, from a store and settings."""
+	entries = ['value%d = compute(%d, "%s")' % (i, i, 'y'*40)
+		for i in xrange(options.history)]
+	storePath = os.path.join(workDir, 'history.jsonl')
+	writer = HistoryStore(storePath, maxEntries=options.history)
+	results = {'storeWrite': _Time(writer.extend, entries)}
+	writer.close()
+
+	widget, inputField = _MakeConsole()
+	store = HistoryStore(storePath, maxEntries=options.history)
+	results['storeLoad'] = _Time(inputField.setHistoryStore, store)
+	store.close()
+
+	def search():
+		_PressKey(inputField, QtCore.Qt.Key_R, QtCore.Qt.ControlModifier)
+		for c in 'compute(99':
+			_PressKey(inputField, 0, QtCore.Qt.NoModifier, c)
+		_PressKey(inputField, QtCore.Qt.Key_Escape)
+	results['search'] = _Time(search)
+
+	settingsPath = os.path.join(workDir, 'history.ini')
+	settings = QtCore.QSettings(settingsPath, QtCore.QSettings.IniFormat)
+	with Settings.GroupGuard(settings, 'PythonInputWidget'):
+		with Settings.ArrayWriteGuard(settings, 'history'):
+			for i, entry in enumerate(entries):
+				settings.setArrayIndex(i)
+				settings.setValue('entry', QtCore.QVariant(entry))
+	settings.sync()
+	widget2, inputField2 = _MakeConsole()
+	settings = QtCore.QSettings(settingsPath, QtCore.QSettings.IniFormat)
+	results['settingsLoad'] = _Time(inputField2.readSettings, settings)
+	widget.deleteLater()
+	widget2.deleteLater()
+	return results
+
+
+def BenchmarkResources(options, workDir):
+	"""Look up options.icons icons spread over options.paths paths."""
+	image = QtGui.QImage(ICON_SIZE, ICON_SIZE, QtGui.QImage.Format_ARGB32)
+	image.fill(0xff336699)
+	filenames = []
+	for i in xrange(options.icons):
+		iconDir = os.path.join(workDir, 'resources%d' % (i % options.paths),
+			ResourceManager.ICON_SUBDIR)
+		if not os.path.isdir(iconDir):
+			os.makedirs(iconDir)
+		filename = 'icon%d.png' % i
+		image.save(os.path.join(iconDir, filename))
+		filenames.append(filename)
+	for i in xrange(options.paths):
+		ResourceManager.AppendResourcePath(
+			os.path.join(workDir, 'resources%d' % i))
+
+	def getIcons():
+		for filename in filenames:
+			ResourceManager.GetIcon(filename).pixmap(ICON_SIZE)
+
+	def getFiles():
+		for filename in filenames:
+			ResourceManager.GetFile(
+				os.path.join(ResourceManager.ICON_SUBDIR, filename))
+
+	results = {
+		'getFile': _Time(getFiles),
+		'getIconCold': _Time(getIcons),
+		'getIconWarm': _Time(getIcons),
+	}
+	ResourceManager.InvalidateImageCache()
+	results['preloadIcons'] = _Time(
+		lambda: ResourceManager.PreloadIcons(filenames).waitForFinished())
+	results['getIconPreloaded'] = _Time(getIcons)
+	return results
+
+
+def BenchmarkSettings(options, workDir):
+	"""Write and read the geometry of options.widgets widgets."""
+	geometry = QtGui.QWidget()
+	geometry.move(10, 20)
+	geometry.resize(300, 200)
+	settingsPath = os.path.join(workDir, 'settings.ini')
+
+	def write(settings):
+		for i in xrange(options.widgets):
+			Settings.WriteWidgetGeometry(settings, 'widget%d' % i,
+				geometry)
+
+	def read(settings):
+		for i in xrange(options.widgets):
+			Settings.ReadWidgetGeometry(settings, 'widget%d' % i,
+				geometry)
+
+	settings = QtCore.QSettings(settingsPath, QtCore.QSettings.IniFormat)
+	results = {'write': _Time(lambda: (write(settings), settings.sync()))}
+
+	def writeSession():
+		session = Settings.SettingsSession(settings)
+		write(session)
+		session.commit()
+	results['writeSessionUnchanged'] = _Time(writeSession)
+
+	settings = QtCore.QSettings(settingsPath, QtCore.QSettings.IniFormat)
+	results['read'] = _Time(read, settings)
+	results['readSnapshot'] = _Time(
+		lambda: read(Settings.ReadSnapshot(settings, '')))
+	geometry.deleteLater()
+	return results
+
+
+def BenchmarkHighlight(options, workDir):
+	"""
+	Highlight an input of options.scriptLines lines, then type letters
+	and brackets at its start, middle and end. A keystroke should take
+	about as long wherever it is typed, and however long the input is.
+	"""
+	widget, inputField = _MakeConsole()
+	lines = []
+	for i in xrange(options.scriptLines/5):
+		lines.extend([
+			'@decorator',
+			'def function%d(argument=0x%x, *args):' % (i, i),
+			'\t"""Return (argument + %d.5) # not a comment."""' % i,
+			'\tresult = [len(args), {"key": \'value\'}]  # comment',
+			'\treturn argument + result[0]',
+		])
+	sourceText = '\n'.join(lines)
+
+	def setText():
+		inputField.setPlainText(sourceText)
+		_ProcessEvents()
+	results = {'setText': _Time(setText)}
+
+	document = inputField.document()
+	for place, blockNumber in (('Start', 0),
+	('Middle', document.blockCount()/2),
+	('End', document.blockCount() - 1)):
+		for name, key, text in (('keystroke', QtCore.Qt.Key_X, 'x'),
+		('bracket', QtCore.Qt.Key_ParenLeft, '(')):
+			block = document.findBlockByNumber(blockNumber)
+			cursor = QtGui.QTextCursor(block)
+			cursor.movePosition(QtGui.QTextCursor.EndOfBlock)
+			inputField.setTextCursor(cursor)
+			start = time.time()
+			for i in xrange(KEYSTROKE_REPEATS):
+				_PressKey(inputField, key, QtCore.Qt.NoModifier, text)
+			results[name + place] = (time.time() - start)/KEYSTROKE_REPEATS
+	widget.deleteLater()
+	return results
+
+
+def BenchmarkImport(options, workDir):
+	"""
+	Import this package in fresh interpreters, for resource lookup only
+	and for the console. The best of IMPORT_REPEATS runs is reported,
+	with the number of modules loaded.
+	"""
+	packageDir = os.path.dirname(os.path.abspath(__file__))
+	results = {}
+	for name, attribute in (('importResourceManager', 'ResourceManager'),
+	('importConsole', 'InteractivePythonWidget')):
+		script = IMPORT_SCRIPT % (os.path.dirname(packageDir),
+			os.path.basename(packageDir), attribute)
+		times = []
+		for i in xrange(IMPORT_REPEATS):
+			output = subprocess.check_output([sys.executable, '-c', script])
+			elapsed, nModules = output.split()
+			times.append(float(elapsed))
+		results[name] = min(times)
+		results[name + 'Modules'] = int(nModules)
+	return results
+
+
+BENCHMARKS = [
+	('import', BenchmarkImport),
+	('output', BenchmarkOutput),
+	('completion', BenchmarkCompletion),
+	('history', BenchmarkHistory),
+	('resources', BenchmarkResources),
+	('settings', BenchmarkSettings),
+	('highlight', BenchmarkHighlight),
+]
+
+
+
+def Main():
+	parser = argparse.ArgumentParser(
+		description='Benchmark the console and resource code.')
+	parser.add_argument('--lines', type=int, default=10000,
+		help='lines of output to print')
+	parser.add_argument('--history', type=int, default=20000,
+		help='history entries (and namespace names) to load')
+	parser.add_argument('--icons', type=int, default=500,
+		help='icon files to look up')
+	parser.add_argument('--paths', type=int, default=10,
+		help='resource paths to spread the icons over')
+	parser.add_argument('--widgets', type=int, default=200,
+		help='widget geometries to write and read')
+	parser.add_argument('--script-lines', dest='scriptLines', type=int,
+		default=5000, help='lines of input to highlight and edit')
+	parser.add_argument('--only', nargs='+', metavar='NAME',
+		choices=[name for name, benchmark in BENCHMARKS],
+		help='run only these benchmarks')
+	options = parser.parse_args()
+
+	app = QtGui.QApplication(sys.argv)
+	workDir = tempfile.mkdtemp(prefix='benchmark')
+	results = {}
+	try:
+		for name, benchmark in BENCHMARKS:
+			if options.only and name not in options.only:
+				continue
+			results[name] = benchmark(options, workDir)
+			_ProcessEvents()
+	finally:
+		shutil.rmtree(workDir, ignore_errors=True)
+
+	report = {
+		'python': sys.version.split()[0],
+		'qt': str(QtCore.qVersion()),
+		'parameters': {
+			'lines': options.lines,
+			'history': options.history,
+			'icons': options.icons,
+			'paths': options.paths,
+			'widgets': options.widgets,
+			'scriptLines': options.scriptLines,
+		},
+		'results': results,
+		'peakMemoryKiB': GetPeakMemoryKiB(),
+	}
+	json.dump(report, sys.stdout, indent=1, sort_keys=True)
+	sys.stdout.write('\n')
+
+
+
+if __name__ == '__main__':
+	Main()
@@ -0,0 +1,134 @@
+"""
+Split console input into statements and compile them, reusing code
+objects for source that was compiled before.
+
+Uses only the standard library, so that KernelProcess can use it too.
+"""
+
+__all__ = [
+	'SplitStatements',
+	'CodeCache',
+]
+
+import collections, linecache, tokenize, __future__, StringIO
+
+CONTINUATION_KEYWORDS = frozenset(['else', 'elif', 'except', 'finally'])
+"""keywords which continue a compound statement at the same depth"""
+
+
+
+def SplitStatements(sourceText):
+	"""
+	Return (first line, last line + 1) line index ranges of the
+	top-level statements in sourceText, with tokenize, in one pass.
+	Comment and blank lines between statements are not included.
+	Return None if sourceText can't be tokenized (for example if it
+	ends in an unclosed bracket).
+	"""
+	statements = []
+	depth = 0
+	start = None
+	"""line index of the first line of the current statement"""
+	end = None
+	"""line index after the last NEWLINE, if no INDENT followed it"""
+	decorator = False
+	readline = StringIO.StringIO(sourceText).readline
+	try:
+		for tokenType, tokenString, (row, col), tokenEnd, line \
+		in tokenize.generate_tokens(readline):
+			if tokenType in (tokenize.NL, tokenize.COMMENT):
+				continue
+			elif tokenType == tokenize.NEWLINE:
+				end = row
+			elif tokenType == tokenize.INDENT:
+				depth += 1
+				end = None
+			elif tokenType == tokenize.DEDENT:
+				depth -= 1
+			elif tokenType == tokenize.ENDMARKER:
+				break
+			else:
+				if end is not None and depth == 0:
+					if not (decorator or (tokenType == tokenize.NAME
+					and tokenString in CONTINUATION_KEYWORDS)):
+						statements.append((start, end))
+						start = None
+					decorator = tokenString == '@'
+				if start is None:
+					start = row - 1
+					decorator = tokenString == '@'
+				end = None
+	except (tokenize.TokenError, SyntaxError):
+		return None
+	if start is not None:
+		statements.append((start, end or sourceText.count('\n') + 1))
+	return statements
+
+
+def _FutureFlags(codeObject):
+	flags = 0
+	for name in __future__.all_feature_names:
+		flag = getattr(__future__, name).compiler_flag
+		if codeObject.co_flags & flag:
+			flags |= flag
+	return flags
+
+
+
+class CodeCache(object):
+	"""
+	Compile source with a codeop.Compile (like the compile attribute
+	of an InteractiveInterpreter's CommandCompiler, so that __future__
+	statements stay in effect), keeping the MAX_ENTRIES most recently
+	used code objects. Entries are keyed by source text and compiler
+	flags.
+	"""
+	MAX_ENTRIES = 2000
+
+	def __init__(self, compiler, maxEntries=MAX_ENTRIES):
+		self.__compiler = compiler
+		self.__maxEntries = maxEntries
+		self.__entries = collections.OrderedDict()
+
+
+	def compile(self, source, filename='<input>', symbol='single'):
+		"""
+		Return a code object for source. Raise SyntaxError, OverflowError
+		or ValueError like compile().
+		"""
+		key = (source, filename, symbol, self.__compiler.flags)
+		codeObject = self.__entries.pop(key, None)
+		if codeObject is None:
+			codeObject = self.__compiler(source, filename, symbol)
+		else:
+			# As the compiler does, keep __future__ features on.
+			self.__compiler.flags |= _FutureFlags(codeObject)
+		self.__entries[key] = codeObject
+		if len(self.__entries) > self.__maxEntries:
+			self.__forget(self.__entries.popitem(last=False)[0])
+		return codeObject
+
+
+	def compileScript(self, source):
+		"""
+		Return a code object for source as a whole module. The code's
+		filename, which is made from source, is entered in linecache,
+		so that tracebacks from it show its lines, until the code
+		object leaves the cache.
+		"""
+		filename = '<script-%08x>' % (hash(source) & 0xffffffff)
+		lines = [line + '\n' for line in source.split('\n')]
+		linecache.cache[filename] = (len(source), None, lines, filename)
+		return self.compile(source + '\n', filename, 'exec')
+
+
+	def clear(self):
+		for key in self.__entries:
+			self.__forget(key)
+		self.__entries.clear()
+
+
+	def __forget(self, key):
+		filename = key[1]
+		if filename.startswith('<script-'):
+			linecache.cache.pop(filename, None)
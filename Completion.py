@@ -0,0 +1,173 @@
+"""
+Complete Python names and attributes from sorted indexes.
+
+Uses only the standard library, so that KernelProcess can use it too.
+"""
+
+__all__ = [
+	'CompletionIndex',
+]
+
+import bisect, keyword, re, time
+import __builtin__
+
+ATTRIBUTE_RE = re.compile(r'(\w+(\.\w+)*)\.(\w*)$')
+
+
+
+def _PrefixSlice(sortedNames, prefix):
+	"""Return the names in sortedNames which start with prefix."""
+	start = bisect.bisect_left(sortedNames, prefix)
+	end = start
+	n = len(sortedNames)
+	while end < n and sortedNames[end].startswith(prefix):
+		end += 1
+	return sortedNames[start:end]
+
+
+def _GetNames(namespace):
+	"""
+	Return the set of names in namespace, which code running on another
+	thread may be changing.
+	"""
+	while True:
+		try:
+			return set(list(namespace.keys()))
+		except RuntimeError:
+			# Changed size during iteration.
+			pass
+
+
+def _GetClassMembers(klass):
+	members = dir(klass)
+	for base in getattr(klass, '__bases__', ()):
+		members.extend(_GetClassMembers(base))
+	return members
+
+
+
+class CompletionIndex(object):
+	"""
+	Give the same completions as rlcompleter.Completer over a namespace,
+	all at once, from sorted name lists.
+
+	The namespace's names are indexed on first use. After code may have
+	changed the namespace, call namespaceChanged(); the index is then
+	updated with only the added and removed names on the next query.
+	Attribute names are indexed per expression (like 'os.path') until
+	the next namespaceChanged().
+
+	Adding '(' to callable completions needs a getattr per match; that
+	stops once a query has taken TIME_BUDGET_S.
+	"""
+	TIME_BUDGET_S = 0.05
+
+	__KEYWORDS = sorted(keyword.kwlist)
+
+	def __init__(self, namespace):
+		self.__namespace = namespace
+		self.__names = None
+		"""sorted list of names in the namespace"""
+		self.__nameSet = None
+		self.__namesChanged = False
+		self.__builtinNames = None
+		self.__attributes = {}
+		"""expression -> (object, sorted list of attribute names)"""
+
+
+	def namespaceChanged(self):
+		self.__namesChanged = True
+		self.__attributes.clear()
+
+
+	def complete(self, text):
+		"""Return a sorted list of completions of text."""
+		deadline = time.time() + self.TIME_BUDGET_S
+		if '.' in text:
+			return self.__completeAttribute(text, deadline)
+		else:
+			return self.__completeName(text, deadline)
+
+
+	def __completeName(self, text, deadline):
+		self.__updateNames()
+		seen = set(_PrefixSlice(self.__KEYWORDS, text))
+		matches = list(seen)
+		# As rlcompleter does, leave out __builtins__.
+		seen.add('__builtins__')
+		# As rlcompleter does, let the namespace's names shadow builtins.
+		for names, namespace in (
+		(self.__names, self.__namespace),
+		(self.__builtinNames, __builtin__.__dict__)):
+			for name in _PrefixSlice(names, text):
+				if name in seen:
+					continue
+				seen.add(name)
+				if time.time() < deadline:
+					name = self.__callablePostfix(
+						namespace.get(name), name)
+				matches.append(name)
+		return sorted(matches)
+
+
+	def __updateNames(self):
+		if self.__builtinNames is None:
+			self.__builtinNames = sorted(__builtin__.__dict__)
+
+		if self.__names is None:
+			self.__nameSet = _GetNames(self.__namespace)
+			self.__names = sorted(self.__nameSet)
+		elif self.__namesChanged:
+			current = _GetNames(self.__namespace)
+			added = current - self.__nameSet
+			removed = self.__nameSet - current
+			if len(added) + len(removed) > len(current)/8:
+				self.__names = sorted(current)
+			else:
+				for name in removed:
+					i = bisect.bisect_left(self.__names, name)
+					del self.__names[i]
+				for name in added:
+					bisect.insort(self.__names, name)
+			self.__nameSet = current
+		self.__namesChanged = False
+
+
+	def __completeAttribute(self, text, deadline):
+		m = ATTRIBUTE_RE.match(text)
+		if not m:
+			return []
+		expr, attr = m.group(1, 3)
+
+		indexed = self.__attributes.get(expr)
+		if indexed is None:
+			try:
+				obj = eval(expr, self.__namespace)
+			except Exception:
+				return []
+			names = set(dir(obj))
+			names.discard('__builtins__')
+			if hasattr(obj, '__class__'):
+				names.add('__class__')
+				names.update(_GetClassMembers(obj.__class__))
+			indexed = (obj, sorted(names))
+			self.__attributes[expr] = indexed
+		obj, names = indexed
+
+		matches = []
+		for name in _PrefixSlice(names, attr):
+			completion = '%s.%s' % (expr, name)
+			if time.time() < deadline:
+				try:
+					completion = self.__callablePostfix(
+						getattr(obj, name), completion)
+				except Exception:
+					continue
+			matches.append(completion)
+		return matches
+
+
+	def __callablePostfix(self, value, word):
+		if hasattr(value, '__call__'):
+			return word + '('
+		return word
@@ -3,21 +3,58 @@ Provide utilities related to GUI drawing, supplemental to QStyle and QPalette.
 """
 
 __all__ = [
+	'GetPaletteValue',
+	'InvalidatePaletteCache',
 	'GetErrorColor',
 ]
 
 from Manifest import QtCore, QtGui
 
+MAX_PALETTE_CACHE_ENTRIES = 256
+
+global paletteCache
+paletteCache = {}
+"""
+(palette cache key, value name) -> value derived from the palette,
+shared by everything that draws with the same palette
+"""
+
+
+def GetPaletteValue(name, makeValue, customPalette=None):
+	"""
+	Return makeValue(palette) for the palette (by default the
+	application palette), computing it only once per palette contents
+	and name. Callers share the value, so must not change it.
+	"""
+	global paletteCache
+	palette = customPalette or QtGui.QApplication.palette()
+	key = (palette.cacheKey(), name)
+	value = paletteCache.get(key)
+	if value is None:
+		if len(paletteCache) >= MAX_PALETTE_CACHE_ENTRIES:
+			# Most entries are for palettes no longer in use.
+			paletteCache.clear()
+		value = makeValue(palette)
+		paletteCache[key] = value
+	return value
+
+
+def InvalidatePaletteCache():
+	global paletteCache
+	paletteCache.clear()
+
 
 def GetErrorColor(customPalette=None):
 	"""
 	Get the color to use for foreground error elements,
 	such as error text.
 	"""
-	palette = customPalette or QtGui.QApplication.palette()
+	return QtGui.QColor(GetPaletteValue('errorColor', _MakeErrorColor,
+		customPalette))
+
+
+def _MakeErrorColor(palette):
 	disabledTextColor = palette.color(QtGui.QPalette.Disabled,
 		QtGui.QPalette.Text)
 	h, s, v, a = disabledTextColor.getHsvF()
 	return QtGui.QColor.fromHsvF(0, s + 0.6, v + 0.2)
-
-
@@ -0,0 +1,125 @@
+"""
+Search command history incrementally.
+"""
+
+__all__ = [
+	'HistorySearchIndex',
+]
+
+from Manifest import collections, heapq
+
+
+
+def _Trigrams(text):
+	return set([text[i:i+3] for i in xrange(len(text) - 2)])
+
+
+
+class HistorySearchIndex(object):
+	"""
+	Find history entries containing a query, case-insensitively, most
+	recent first.
+
+	Each distinct entry is indexed by its trigrams. A query of three or
+	more characters only examines the entries which have all of its
+	trigrams, so its cost depends on how selective the query is rather
+	than on how long the history is. Shorter queries scan back from the
+	most recent entry until enough matches are found.
+
+	If nothing contains the query, entries sharing at least
+	FUZZY_MIN_SHARED of the query's trigrams are returned instead,
+	best first.
+	"""
+	MAX_RESULTS = 50
+	FUZZY_MIN_SHARED = 0.5
+
+	def __init__(self, entries=()):
+		self.__entries = []
+		"""entry id -> text"""
+		self.__lowerEntries = []
+		"""entry id -> lower-case text"""
+		self.__ids = {}
+		"""text -> entry id"""
+		self.__recency = []
+		"""entry id -> when last added"""
+		self.__order = []
+		"""entry ids in the order added, possibly repeated"""
+		self.__trigrams = collections.defaultdict(set)
+		"""trigram -> set of entry ids"""
+		for text in entries:
+			self.add(text)
+
+
+	def add(self, text):
+		entryId = self.__ids.get(text)
+		if entryId is None:
+			entryId = len(self.__entries)
+			self.__ids[text] = entryId
+			lowerText = text.lower()
+			self.__entries.append(text)
+			self.__lowerEntries.append(lowerText)
+			self.__recency.append(None)
+			for trigram in _Trigrams(lowerText):
+				self.__trigrams[trigram].add(entryId)
+		self.__recency[entryId] = len(self.__order)
+		self.__order.append(entryId)
+
+
+	def search(self, query, maxResults=MAX_RESULTS):
+		"""Return up to maxResults entries matching query."""
+		query = query.lower()
+		if not query:
+			return []
+		if len(query) < 3:
+			return self.__scanRecent(query, maxResults)
+
+		trigrams = _Trigrams(query)
+		postings = sorted([self.__trigrams.get(t, ()) for t in trigrams],
+			key=len)
+		candidates = set(postings[0])
+		for posting in postings[1:]:
+			if not candidates:
+				break
+			candidates.intersection_update(posting)
+
+		matches = [i for i in candidates
+			if query in self.__lowerEntries[i]]
+		if matches:
+			best = heapq.nlargest(maxResults, matches,
+				key=self.__recency.__getitem__)
+		else:
+			best = self.__fuzzySearch(trigrams, postings, maxResults)
+		return [self.__entries[i] for i in best]
+
+
+	def __scanRecent(self, query, maxResults):
+		matches = []
+		for i in xrange(len(self.__order) - 1, -1, -1):
+			entryId = self.__order[i]
+			if (self.__recency[entryId] == i
+			and query in self.__lowerEntries[entryId]):
+				matches.append(entryId)
+				if len(matches) >= maxResults:
+					break
+		return [self.__entries[i] for i in matches]
+
+
+	def __fuzzySearch(self, trigrams, postings, maxResults):
+		"""
+		postings are sorted smallest first. An entry with minShared of
+		the trigrams must be in one of the smallest
+		(len(postings) - minShared + 1) postings, so only those are
+		used to find candidates.
+		"""
+		minShared = max(1, int(len(trigrams)*self.FUZZY_MIN_SHARED))
+		candidates = set()
+		for posting in postings[:len(postings) - minShared + 1]:
+			candidates.update(posting)
+
+		shared = {}
+		for i in candidates:
+			n = sum([1 for posting in postings if i in posting])
+			if n >= minShared:
+				shared[i] = n
+		return heapq.nlargest(maxResults, shared,
+			key=lambda i: (shared[i], self.__recency[i]))
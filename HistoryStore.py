@@ -0,0 +1,135 @@
+"""
+Keep console command history in an append-only journal file.
+"""
+
+__all__ = [
+	'HistoryStore',
+]
+
+from Manifest import os, json, threading, logging
+
+log = logging.getLogger('HistoryStore')
+
+
+
+class HistoryStore(object):
+	"""
+	Store history entries in a file, one JSON-encoded entry per line.
+
+	Each entry is appended as it is added, so saving costs nothing at
+	shutdown. Once the journal holds COMPACT_RATIO times maxEntries, it
+	is rewritten with only the newest maxEntries on a background thread.
+	"""
+	MAX_ENTRIES = 100000
+	COMPACT_RATIO = 1.5
+
+	def __init__(self, path, maxEntries=MAX_ENTRIES):
+		self.__path = os.path.abspath(path)
+		self.__maxEntries = maxEntries
+		self.__lock = threading.Lock()
+		self.__file = None
+		self.__nJournalEntries = 0
+		self.__compacting = False
+
+
+	def path(self):
+		return self.__path
+
+
+	def load(self):
+		"""Return the newest maxEntries entries, oldest first."""
+		with self.__lock:
+			entries = self.__read()
+			self.__nJournalEntries = len(entries)
+		return entries[-self.__maxEntries:]
+
+
+	def append(self, text):
+		self.extend([text])
+
+
+	def extend(self, texts):
+		if not texts:
+			return
+		with self.__lock:
+			if self.__file is None:
+				self.__file = open(self.__path, 'a')
+			self.__file.write(''.join(
+				[json.dumps(text) + '\n' for text in texts]))
+			self.__file.flush()
+			self.__nJournalEntries += len(texts)
+			shouldCompact = not self.__compacting and \
+				self.__nJournalEntries \
+				> self.__maxEntries*self.COMPACT_RATIO
+			if shouldCompact:
+				self.__compacting = True
+		if shouldCompact:
+			compactThread = threading.Thread(target=self.__compact)
+			compactThread.daemon = True
+			compactThread.start()
+
+
+	def close(self):
+		with self.__lock:
+			if self.__file is not None:
+				self.__file.close()
+				self.__file = None
+
+
+	def __read(self, size=None):
+		try:
+			with open(self.__path) as f:
+				if size is None:
+					data = f.read()
+				else:
+					data = f.read(size)
+		except IOError:
+			return []
+		entries = []
+		for line in data.splitlines():
+			try:
+				entries.append(json.loads(line))
+			except ValueError:
+				log.warning("skipping bad history entry in '%s'"
+					% self.__path)
+		return entries
+
+
+	def __compact(self):
+		"""
+		Rewrite the journal with only the newest entries. Entries
+		appended meanwhile are carried over to the new journal.
+		"""
+		try:
+			with self.__lock:
+				if self.__file is not None:
+					self.__file.flush()
+				size = os.path.getsize(self.__path)
+
+			entries = self.__read(size)[-self.__maxEntries:]
+			tmpPath = self.__path + '.tmp'
+			with open(tmpPath, 'w') as tmpFile:
+				tmpFile.write(''.join(
+					[json.dumps(text) + '\n' for text in entries]))
+
+				with self.__lock:
+					if self.__file is not None:
+						self.__file.close()
+						self.__file = None
+					with open(self.__path) as f:
+						f.seek(size)
+						appended = f.read()
+					tmpFile.write(appended)
+					tmpFile.close()
+					if os.name == 'nt':
+						os.remove(self.__path)
+					os.rename(tmpPath, self.__path)
+					self.__nJournalEntries = len(entries) \
+						+ appended.count('\n')
+			log.debug("compacted history in '%s' to %d entries"
+				% (self.__path, self.__nJournalEntries))
+		except (IOError, OSError) as e:
+			log.warning("failed to compact history in '%s': %s"
+				% (self.__path, e))
+		finally:
+			self.__compacting = False
@@ -1,11 +1,17 @@
 __all__ = [
 	'InteractivePythonWidget',
+	'ExecutionRecord',
 ]
 
 from Manifest import QtCore, QtGui, \
-	code, sys, traceback, rlcompleter, os, enum, \
-	logging
-import Drawing, Settings
+	code, sys, traceback, os, enum, \
+	logging, threading, Queue, ctypes, \
+	collections, time, __builtin__, reprlib
+import Drawing, Settings, MagicCommands
+from Completion import CompletionIndex
+from CodeCache import CodeCache, SplitStatements
+from HistorySearch import HistorySearchIndex
+from PythonHighlighter import PythonHighlighter
 
 log = logging.getLogger('InteractivePythonWidget')
 log.setLevel(logging.DEBUG)
@@ -16,16 +22,31 @@ log.setLevel(logging.DEBUG)
 class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 	"""
 	Execute Python and show the results of execution.
+
+	Values of expressions are shown abbreviated (see DisplayRepr); a
+	"show more" link after an abbreviated value shows its full repr, a
+	chunk of SHOW_MORE_CHARACTERS at a time. Links for only the last
+	MAX_EXPANDABLE_VALUES values are kept working, since each keeps
+	its value alive.
+
+	Each execution is measured, and the measurements kept as
+	ExecutionRecords in a ring buffer of the last
+	MAX_EXECUTION_RECORDS (see executionRecords()).
+
+	Signals:
+		executionRecorded	ExecutionRecord
 	"""
 	TAB_WIDTH = 4
+	MAX_EXECUTION_RECORDS = 1000
+	MAX_EXPANDABLE_VALUES = 50
+	SHOW_MORE_CHARACTERS = 20000
+	SHOW_MORE_TEXT = ' [show more]'
 	TB_HEADER = 'Traceback (most recent call last):'
 	__STYLE = enum.Enum('OUTPUT', 'CONTEXT', 'ERROR')
 	__SETTINGS_GROUP_NAME = 'InteractivePythonWidget'
 	__SETTINGS_NAME_SPLITTER = 'splitter'
 	__SETTINGS_NAME_GEOMETRY = 'windowGeometry'
 
-	__OUTPUT_FORMATS = None
-
 	def __init__(self, parent=None, locals={}):
 		QtGui.QWidget.__init__(self, parent)
 
@@ -33,9 +54,36 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 		self.__outRedirect = StdRedirect(sys.stdout, self.writeStdout)
 		sys.stderr = self.__errRedirect
 		sys.stdout = self.__outRedirect
+		self.__displayHook = DisplayHook(sys.displayhook,
+			self.__displayValue)
+		sys.displayhook = self.__displayHook
+		self.__displayRepr = DisplayRepr()
+		self.__expansions = collections.OrderedDict()
+		"""
+		link href -> [iterator over pieces of the rest of a repr,
+		whether any was shown yet]
+		"""
+		self.__expansionsLock = threading.Lock()
+		self.__nextExpansionId = 0
 		self.__errorOccurred = False
+		self.__executionThread = None
+		self.__backend = None
+		self.__pendingCount = 0
+		self.__executionRecords = collections.deque(
+			maxlen=self.MAX_EXECUTION_RECORDS)
+		self.__runningRecords = collections.deque()
+		"""ExecutionRecords of submissions not yet finished, in order"""
+		self.__measurements = collections.deque()
+		"""
+		(wall time, CPU time, peak memory) of finished in-process
+		executions not yet recorded
+		"""
+		self.__outputCharacters = 0
+		self.__outputMark = 0
+		self.__memoryTracing = False
 
 		code.InteractiveInterpreter.__init__(self, locals)
+		self.__codeCache = CodeCache(self.compile.compiler)
 
 		f = QtGui.QFont()
 		f.setFixedPitch(True)
@@ -54,15 +102,50 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 		layout.addWidget(self.__menuBar)
 		viewMenu = self.__menuBar.addMenu('View')
 		viewMenu.addAction('History', self.__showHistory)
+		runMenu = self.__menuBar.addMenu('Run')
+		self.__backgroundAction = runMenu.addAction(
+			'Run in Background')
+		self.__backgroundAction.setCheckable(True)
+		QtCore.QObject.connect(self.__backgroundAction,
+			QtCore.SIGNAL('toggled(bool)'),
+			self.setBackgroundExecution)
+		self.__interruptAction = runMenu.addAction('Interrupt',
+			self.interrupt)
+		self.__interruptAction.setEnabled(False)
+		self.__restartAction = runMenu.addAction('Restart Kernel',
+			self.__restartBackend)
+		self.__restartAction.setEnabled(False)
+
+		statusWidget = QtGui.QWidget(self.__menuBar)
+		statusLayout = QtGui.QHBoxLayout(statusWidget)
+		statusLayout.setMargin(0)
+		self.__statusLabel = QtGui.QLabel(statusWidget)
+		statusLayout.addWidget(self.__statusLabel)
+		self.__recordLabel = QtGui.QLabel(statusWidget)
+		statusLayout.addWidget(self.__recordLabel)
+		self.__busyIndicator = QtGui.QProgressBar(statusWidget)
+		self.__busyIndicator.setRange(0, 0)
+		self.__busyIndicator.setTextVisible(False)
+		self.__busyIndicator.setMaximumHeight(
+			self.__menuBar.sizeHint().height()/2)
+		self.__busyIndicator.hide()
+		statusLayout.addWidget(self.__busyIndicator)
+		self.__menuBar.setCornerWidget(statusWidget)
 
 		self.__splitter = QtGui.QSplitter(QtCore.Qt.Vertical, self)
 		layout.addWidget(self.__splitter)
 
 		tabWidth = self.TAB_WIDTH*self.fontMetrics().averageCharWidth()
-		self.__outputField = QtGui.QTextEdit(self.__splitter)
+		self.__outputField = QtGui.QTextBrowser(self.__splitter)
 		self.__outputField.setReadOnly(True)
+		self.__outputField.setOpenLinks(False)
+		QtCore.QObject.connect(self.__outputField,
+			QtCore.SIGNAL('anchorClicked(const QUrl&)'),
+			self.__showMore)
+		self.__outputField.setUndoRedoEnabled(False)
 		self.__outputField.setTabStopWidth(tabWidth)
 		self.__splitter.addWidget(self.__outputField)
+		self.__output = OutputBuffer(self.__outputField)
 
 		self.__inputField = PythonInputWidget(self, locals)
 		self.__inputField.setAcceptRichText(False)
@@ -72,40 +155,333 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 
 		QtCore.QObject.connect(self.__inputField,
 			QtCore.SIGNAL('execute'), self.__execute)
+		QtCore.QObject.connect(self.__inputField,
+			QtCore.SIGNAL('executeScript'), self.__executeScript)
 		QtCore.QObject.connect(self.__inputField,
 			QtCore.SIGNAL('completions'), self.__showCompletions)
+		QtCore.QObject.connect(self.__inputField,
+			QtCore.SIGNAL('interrupt'), self.interrupt)
+		QtCore.QObject.connect(self.__inputField,
+			QtCore.SIGNAL('searchStatus'), self.__statusLabel.setText)
+		QtCore.QObject.connect(QtGui.QApplication.instance(),
+			QtCore.SIGNAL('aboutToQuit()'),
+			self.__stopExecutionThread)
 
 
 	def __initFormats(self):
-		if self.__OUTPUT_FORMATS is not None:
-			return
-		self.__OUTPUT_FORMATS = {}
+		"""
+		Get the output formats for the current palette, shared with
+		other consoles using the same palette.
+		"""
+		self.__OUTPUT_FORMATS = Drawing.GetPaletteValue(
+			'InteractivePythonWidget.outputFormats',
+			self.__makeOutputFormats, self.palette())
+
+
+	def __makeOutputFormats(self, palette):
+		formats = {}
 		for style in self.__STYLE:
 			format = QtGui.QTextCharFormat()
 			if style == self.__STYLE.OUTPUT:
-				color = self.palette().color(
-					QtGui.QPalette.Text)
+				color = palette.color(QtGui.QPalette.Text)
 			elif style == self.__STYLE.CONTEXT:
-				color = self.palette().color(
-					QtGui.QPalette.Disabled,
+				color = palette.color(QtGui.QPalette.Disabled,
 					QtGui.QPalette.Text)
 			elif style == self.__STYLE.ERROR:
-				color = Drawing.GetErrorColor()
+				color = Drawing.GetErrorColor(palette)
 			format.setForeground(QtGui.QBrush(color))
-			self.__OUTPUT_FORMATS[style] = format
+			formats[style] = format
+		return formats
+
+
+	def changeEvent(self, event):
+		if event.type() == QtCore.QEvent.PaletteChange:
+			# Text already shown keeps its old colors.
+			self.__initFormats()
+		QtGui.QWidget.changeEvent(self, event)
+
+
+	def __execute(self, sourceText, asScript=False):
+		record = ExecutionRecord(sourceText)
+		if not self.__runningRecords:
+			self.__startRecord(record)
+		self.__runningRecords.append(record)
+		if self.__backend is not None:
+			self.__setPendingCount(self.__pendingCount + 1)
+			self.__backend.execute(sourceText, asScript)
+		elif self.__executionThread is not None:
+			self.__setPendingCount(self.__pendingCount + 1)
+			self.__executionThread.submit(sourceText, asScript)
+		else:
+			# runcode passes SystemExit on; the record and its
+			# measurements must still be taken off their queues.
+			errorOccurred = True
+			try:
+				errorOccurred = self.__runSource(sourceText, asScript)
+			finally:
+				self.__executionFinished(sourceText, errorOccurred)
+
+
+	def __executeScript(self, sourceText):
+		self.__execute(sourceText, True)
+
+
+	def __runSource(self, sourceText, asScript=False):
+		"""
+		Run user code with output redirected to this widget.
+		Return whether an error occurred.
+		"""
+		startPeakMemory = None
+		if self.__memoryTracing:
+			startPeakMemory = MagicCommands.GetPeakMemoryKiB()
+		startTime = time.time()
+		startCpuTime = _CpuTime()
+		try:
+			with self.__errRedirect:
+				with self.__outRedirect:
+					with self.__displayHook:
+						self.__errorOccurred = False
+						if asScript:
+							self.__runScript(sourceText)
+						else:
+							self.__runSourceGradually(sourceText)
+		finally:
+			cpuTime = _CpuTime() - startCpuTime
+			wallTime = time.time() - startTime
+			peakMemory = None
+			if startPeakMemory is not None:
+				peakMemory = 1024*(MagicCommands.GetPeakMemoryKiB()
+					- startPeakMemory)
+			self.__measurements.append((wallTime, cpuTime, peakMemory))
+		return self.__errorOccurred
+
+
+	def __executionFinished(self, sourceText, errorOccurred):
+		self.__output.flush()
+		self.__recordExecution(errorOccurred)
+		if self.__backend is None:
+			self.__inputField.namespaceChanged()
+		if not errorOccurred:
+			self.__inputField.executionComplete(sourceText)
+
+
+	def __startRecord(self, record):
+		record.startTime = time.time()
+		self.__outputMark = self.__outputCharacters
+
+
+	def __recordExecution(self, errorOccurred):
+		if not self.__runningRecords:
+			return
+		record = self.__runningRecords.popleft()
+		record.errorOccurred = errorOccurred
+		record.outputCharacters = \
+			self.__outputCharacters - self.__outputMark
+		if self.__backend is None and self.__measurements:
+			record.wallTime, record.cpuTime, record.peakMemory = \
+				self.__measurements.popleft()
+		else:
+			record.wallTime = time.time() - record.startTime
+		if self.__runningRecords:
+			self.__startRecord(self.__runningRecords[0])
+
+		self.__executionRecords.append(record)
+		self.__recordLabel.setText(record.summary())
+		self.emit(QtCore.SIGNAL('executionRecorded'), record)
+
+
+	def __discardRunningRecords(self):
+		self.__runningRecords.clear()
+		self.__measurements.clear()
+
+
+	def executionRecords(self):
+		"""Return the kept ExecutionRecords, oldest first."""
+		return list(self.__executionRecords)
+
+
+	def setMaximumExecutionRecords(self, n):
+		self.__executionRecords = collections.deque(
+			self.__executionRecords, maxlen=n)
+
+
+	def setMemoryTracing(self, enabled):
+		"""
+		Record how much each in-process execution raises the process's
+		peak resident memory, where the platform reports it (not on
+		Windows).
+		"""
+		self.__memoryTracing = enabled \
+			and MagicCommands.GetPeakMemoryKiB() is not None
+
+
+	def __backgroundExecutionFinished(self, sourceText, errorOccurred):
+		self.__setPendingCount(max(0, self.__pendingCount - 1))
+		self.__executionFinished(sourceText, errorOccurred)
+
+
+	def __setPendingCount(self, n):
+		self.__pendingCount = n
+		self.__busyIndicator.setVisible(n > 0)
+		self.__busyIndicator.setToolTip('%d queued' % n)
+		self.__interruptAction.setEnabled(n > 0)
+		self.__backgroundAction.setEnabled(
+			n == 0 and self.__backend is None)
 
 
-	def __execute(self, sourceText):
-		with self.__errRedirect:
-			with self.__outRedirect:
-				self.__errorOccurred = False
-				self.__runSourceGradually(sourceText)
+	def setBackgroundExecution(self, enabled):
+		"""
+		Run user code on a worker thread, so that the GUI stays
+		responsive. Submissions made while code is running are queued.
+		Only takes effect while nothing is executing.
+		"""
+		if self.__pendingCount or self.__backend is not None:
+			enabled = self.__executionThread is not None
+		elif enabled and self.__executionThread is None:
+			self.__executionThread = ExecutionThread(
+				self.__runSource, self)
+			QtCore.QObject.connect(self.__executionThread,
+				QtCore.SIGNAL('executed'),
+				self.__backgroundExecutionFinished)
+			self.__executionThread.start()
+		elif not enabled:
+			self.__stopExecutionThread()
+		self.__backgroundAction.setChecked(enabled)
+
+
+	def setBackend(self, backend):
+		"""
+		Run code in backend (for example a SubprocessKernel) instead of
+		in this process, or in this process again if backend is None.
+		Only takes effect while nothing is executing.
+
+		A backend provides execute(sourceText, asScript), complete(text),
+		interrupt() and restart(), and emits 'output' (text, stream
+		name) and 'executed' (source text, whether an error occurred).
+		"""
+		if self.__pendingCount or backend is self.__backend:
+			return
+		self.setBackgroundExecution(False)
+		if self.__backend is not None:
+			QtCore.QObject.disconnect(self.__backend,
+				QtCore.SIGNAL('output'), self.__writeBackendOutput)
+			QtCore.QObject.disconnect(self.__backend,
+				QtCore.SIGNAL('executed'),
+				self.__backgroundExecutionFinished)
+
+		self.__backend = backend
+		self.__discardRunningRecords()
+		if backend is None:
+			self.__inputField.setCompletionFunction(None)
+		else:
+			QtCore.QObject.connect(backend,
+				QtCore.SIGNAL('output'), self.__writeBackendOutput)
+			QtCore.QObject.connect(backend,
+				QtCore.SIGNAL('executed'),
+				self.__backgroundExecutionFinished)
+			self.__inputField.setCompletionFunction(backend.complete)
+		self.__restartAction.setEnabled(backend is not None)
+		self.__setPendingCount(0)
+
+
+	def backend(self):
+		return self.__backend
+
+
+	def __restartBackend(self):
+		if self.__backend is not None:
+			self.__backend.restart()
+			self.__appendOutputText('Restarted kernel.\n',
+				self.__STYLE.CONTEXT)
+
+
+	def interrupt(self):
+		"""
+		Raise KeyboardInterrupt in code running in the background or
+		in the backend.
+		"""
+		if self.__backend is not None:
+			self.__backend.interrupt()
+		elif self.__executionThread is not None:
+			self.__executionThread.interrupt()
 
-		if not self.__errorOccurred:
-			self.__inputField.executionComplete()
+
+	def __stopExecutionThread(self):
+		if self.__executionThread is None:
+			return
+		self.__executionThread.stop()
+		self.__executionThread.interrupt()
+		self.__executionThread.wait()
+		self.__executionThread = None
+		self.__discardRunningRecords()
+		self.__setPendingCount(0)
 
 
 	def __runSourceGradually(self, sourceText):
+		"""
+		Run sourceText a statement at a time, echoing each statement
+		before running it. Statements are found in one pass where
+		possible, and otherwise by compiling line by line.
+		"""
+		statements = SplitStatements(sourceText)
+		if statements is None:
+			self.__runLinesGradually(sourceText)
+		else:
+			self.__runStatements(sourceText.split('\n'), statements)
+
+
+	def __runScript(self, sourceText):
+		"""
+		Run sourceText as one module, echoing only its first line. Its
+		lines show in tracebacks, with their line numbers in the whole
+		text.
+		"""
+		lines = sourceText.split('\n')
+		echoText = '%s%s\n' % (sys.ps1, lines[0])
+		if len(lines) > 1:
+			echoText += '%s(%d more lines)\n' % (sys.ps2, len(lines) - 1)
+		self.__appendOutputText(echoText, self.__STYLE.CONTEXT)
+		try:
+			codeObject = self.__codeCache.compileScript(sourceText)
+		except (OverflowError, SyntaxError, ValueError):
+			self.showsyntaxerror()
+			return
+		self.runcode(codeObject)
+
+
+	def __runStatements(self, lines, statements):
+		echoed = 0
+		for start, end in statements:
+			echoLines = ['%s%s\n' % (sys.ps1, line)
+				for line in lines[echoed:start + 1]]
+			echoLines.extend(['%s%s\n' % (sys.ps2, line)
+				for line in lines[start + 1:end]])
+			self.__appendOutputText(''.join(echoLines),
+				self.__STYLE.CONTEXT)
+			echoed = end
+
+			if end - start == 1 and MagicCommands.IsMagic(lines[start]):
+				self.__runMagic(lines[start])
+			else:
+				self.__runCompiled('\n'.join(lines[start:end]) + '\n')
+			if self.__errorOccurred:
+				return
+		if echoed < len(lines):
+			self.__appendOutputText(''.join(['%s%s\n' % (sys.ps1, line)
+				for line in lines[echoed:]]), self.__STYLE.CONTEXT)
+
+
+	def __runCompiled(self, source):
+		"""Like runsource, for a complete statement."""
+		try:
+			codeObject = self.__codeCache.compile(source)
+		except (OverflowError, SyntaxError, ValueError):
+			self.showsyntaxerror()
+			return
+		self.runcode(codeObject)
+
+
+	def __runLinesGradually(self, sourceText):
 		lines = sourceText.split('\n')
 		buffer = ''
 		for line in lines:
@@ -116,6 +492,11 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 			self.__appendOutputText('%s%s\n' % (prompt,  line),
 				self.__STYLE.CONTEXT)
 
+			if not buffer and MagicCommands.IsMagic(line):
+				self.__runMagic(line)
+				if self.__errorOccurred:
+					break
+				continue
 			buffer += '\n' + line
 			if not self.runsource(buffer):
 				buffer = ''
@@ -131,6 +512,21 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 					self.__STYLE.ERROR)
 
 
+	def __runMagic(self, line):
+		"""Run a magic command (see MagicCommands), like runcode."""
+		try:
+			outputText = MagicCommands.RunMagic(line, self.locals)
+		except (MagicCommands.MagicError, SyntaxError):
+			self.__errorOccurred = True
+			self.__showInputError()
+		except SystemExit:
+			raise
+		except:
+			self.showtraceback()
+		else:
+			self.__appendOutputText(outputText, self.__STYLE.OUTPUT)
+
+
 	def write(self, outputText):
 		"""Undifferentiated writing (not used)."""
 		self.__appendOutputText('unexpected write: ' + outputText,
@@ -183,22 +579,139 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 		self.__appendOutputText(outputText, self.__STYLE.ERROR)
 
 
+	def __writeBackendOutput(self, outputText, streamName):
+		if streamName == 'stdout':
+			style = self.__STYLE.OUTPUT
+		elif streamName == 'context':
+			style = self.__STYLE.CONTEXT
+		else:
+			style = self.__STYLE.ERROR
+		self.__appendOutputText(outputText, style)
+
+
+	def __displayValue(self, value):
+		"""Like sys.displayhook, but abbreviating the repr."""
+		if value is None:
+			return
+		__builtin__._ = None
+		text, abbreviated = self.__displayRepr.repr(value)
+		self.__appendOutputText(text, self.__STYLE.OUTPUT)
+		if abbreviated:
+			with self.__expansionsLock:
+				href = 'more:%d' % self.__nextExpansionId
+				self.__nextExpansionId += 1
+				self.__expansions[href] = [
+					_IterRepr(value, self.SHOW_MORE_CHARACTERS), False]
+				while len(self.__expansions) > self.MAX_EXPANDABLE_VALUES:
+					self.__expansions.popitem(last=False)
+			self.__output.append(self.SHOW_MORE_TEXT,
+				self.__getLinkFormat(href))
+		self.__appendOutputText('\n', self.__STYLE.OUTPUT)
+		__builtin__._ = value
+
+
+	def __getLinkFormat(self, href):
+		format = QtGui.QTextCharFormat(
+			self.__OUTPUT_FORMATS[self.__STYLE.CONTEXT])
+		format.setAnchor(True)
+		format.setAnchorHref(href)
+		format.setFontUnderline(True)
+		return format
+
+
+	def __showMore(self, url):
+		"""
+		Replace a "show more" link with the next chunk of its value's
+		repr, followed by the link again if there is more.
+		"""
+		href = str(url.toString())
+		self.__output.flush()
+		cursor = self.__findLink(href)
+		if cursor is None:
+			return
+		with self.__expansionsLock:
+			expansion = self.__expansions.get(href)
+		if expansion is None:
+			cursor.insertText(' [value discarded]',
+				self.__OUTPUT_FORMATS[self.__STYLE.CONTEXT])
+			return
+
+		pieces, started = expansion
+		chunk = []
+		if not started:
+			chunk.append('\n')
+			expansion[1] = True
+		nCharacters = 0
+		deadline = time.time() + DisplayRepr.TIME_BUDGET_S
+		finished = True
+		try:
+			for piece in pieces:
+				chunk.append(piece)
+				nCharacters += len(piece)
+				if (nCharacters >= self.SHOW_MORE_CHARACTERS
+				or time.time() > deadline):
+					finished = False
+					break
+		except Exception as e:
+			chunk.append(' <%s: %s>' % (e.__class__.__name__, e))
+
+		cursor.beginEditBlock()
+		cursor.insertText(''.join(chunk),
+			self.__OUTPUT_FORMATS[self.__STYLE.OUTPUT])
+		if finished:
+			with self.__expansionsLock:
+				self.__expansions.pop(href, None)
+		else:
+			cursor.insertText(self.SHOW_MORE_TEXT,
+				self.__getLinkFormat(href))
+		cursor.endEditBlock()
+
+
+	def __findLink(self, href):
+		"""
+		Return a cursor selecting the link to href in the output, or
+		None. Links are usually near the end, so search backwards.
+		"""
+		block = self.__outputField.document().lastBlock()
+		while block.isValid():
+			fragments = block.begin()
+			while not fragments.atEnd():
+				fragment = fragments.fragment()
+				if fragment.charFormat().anchorHref() == href:
+					cursor = QtGui.QTextCursor(block.document())
+					cursor.setPosition(fragment.position())
+					cursor.setPosition(
+						fragment.position() + fragment.length(),
+						QtGui.QTextCursor.KeepAnchor)
+					return cursor
+				fragments += 1
+			block = block.previous()
+		return None
+
+
 	def __showCompletions(self, completionList):
 		self.__appendOutputText('%s\n' % completionList,
 			self.__STYLE.CONTEXT)
 
 
 	def __appendOutputText(self, text, style):
-		with ScrollKeepOrFollowGuard(self.__outputField):
-			format = self.__OUTPUT_FORMATS[style]
-			self.__outputField.moveCursor(QtGui.QTextCursor.End)
-			self.__outputField.textCursor().insertText(text, format)
+		if style != self.__STYLE.CONTEXT:
+			self.__outputCharacters += len(text)
+		self.__output.append(text, self.__OUTPUT_FORMATS[style])
 
 
 	def __showHistory(self):
 		self.__inputField.showAllHistory()
 
 
+	def setMaximumScrollback(self, lines=None, characters=None):
+		"""
+		Limit how much output is kept; the oldest lines are discarded
+		once either limit is exceeded. None means unlimited.
+		"""
+		self.__output.setMaximumScrollback(lines, characters)
+
+
 	def writeSettings(self, settings):
 		with Settings.GroupGuard(settings, self.__SETTINGS_GROUP_NAME):
 			Settings.WriteWidgetGeometry(settings,
@@ -209,88 +722,600 @@ class InteractivePythonWidget(QtGui.QWidget, code.InteractiveInterpreter):
 
 
 	def readSettings(self, settings):
-		with Settings.GroupGuard(settings, self.__SETTINGS_GROUP_NAME):
-			Settings.ReadWidgetGeometry(settings,
-				self.__SETTINGS_NAME_GEOMETRY, self)
-			splitterSettings = settings.value(
-				self.__SETTINGS_NAME_SPLITTER).toByteArray()
-			if not splitterSettings.isNull():
-				self.__splitter.restoreState(splitterSettings)
-			self.__inputField.readSettings(settings)
+		"""
+		settings may be a QSettings or a Settings.SettingsSnapshot; in
+		either case this widget's group is read in one pass.
+		"""
+		snapshot = Settings.ReadSnapshot(settings,
+			self.__SETTINGS_GROUP_NAME)
+		Settings.ReadWidgetGeometry(snapshot,
+			self.__SETTINGS_NAME_GEOMETRY, self)
+		splitterSettings = snapshot.value(
+			self.__SETTINGS_NAME_SPLITTER).toByteArray()
+		if not splitterSettings.isNull():
+			self.__splitter.restoreState(splitterSettings)
+		self.__inputField.readSettings(snapshot)
+
+
+
+def _FormatSeconds(seconds):
+	if seconds >= 1:
+		return '%.2f s' % seconds
+	return '%.1f ms' % (seconds*1e3)
+
+
+# time.clock is wall time on Windows.
+_CpuTime = getattr(time, 'process_time', None) or \
+	(os.name == 'nt' and (lambda: os.times()[0]) or time.clock)
+
+
+
+class ExecutionRecord(object):
+	"""
+	Measurements of one execution of console input. Times are in
+	seconds. cpuTime is the process's CPU time while the code ran, and
+	is None for code run by a backend; peakMemory is how many bytes the
+	process's peak resident memory rose by, and is None unless memory
+	tracing was on (see InteractivePythonWidget.setMemoryTracing).
+	"""
+	def __init__(self, sourceText):
+		self.sourceText = sourceText
+		self.startTime = time.time()
+		self.wallTime = None
+		self.cpuTime = None
+		self.outputCharacters = 0
+		self.errorOccurred = None
+		self.peakMemory = None
+
+
+	def summary(self):
+		"""Return a one-line description."""
+		parts = [_FormatSeconds(self.wallTime)]
+		if self.cpuTime is not None:
+			parts.append('CPU %s' % _FormatSeconds(self.cpuTime))
+		parts.append('%d chars out' % self.outputCharacters)
+		if self.peakMemory is not None:
+			parts.append('peak +%d KiB' % (self.peakMemory/1024))
+		if self.errorOccurred:
+			parts.append('error')
+		return ', '.join(parts)
+
+
+	def __repr__(self):
+		return '<ExecutionRecord %s>' % self.summary()
+
+
+
+class DisplayRepr(reprlib.Repr):
+	"""
+	Make abbreviated reprs for showing values, with limits generous
+	enough that most values are shown in full. Stop expanding after
+	TIME_BUDGET_S.
+	"""
+	TIME_BUDGET_S = 0.05
+
+	def __init__(self):
+		reprlib.Repr.__init__(self)
+		self.maxlevel = 6
+		self.maxtuple = self.maxlist = self.maxarray = 100
+		self.maxset = self.maxfrozenset = self.maxdeque = 100
+		self.maxdict = 50
+		self.maxstring = self.maxlong = self.maxother = 2000
+		self.__deadline = None
+		self.__abbreviated = False
+
+
+	def repr(self, x):
+		"""Return (repr of x, whether the repr was abbreviated)."""
+		self.__deadline = time.time() + self.TIME_BUDGET_S
+		self.__abbreviated = False
+		text = reprlib.Repr.repr(self, x)
+		return text, self.__abbreviated
+
+
+	def repr1(self, x, level):
+		if time.time() > self.__deadline:
+			self.__abbreviated = True
+			return '...'
+		typeName = '_'.join(type(x).__name__.split())
+		reprType = getattr(self, 'repr_' + typeName, None)
+		if reprType is not None:
+			return reprType(x, level)
+		return self.__abbreviate(repr(x), self.maxother)
+
+
+	def _repr_iterable(self, x, level, left, right, maxiter, trail=''):
+		if len(x) > maxiter or (level <= 0 and len(x)):
+			self.__abbreviated = True
+		return reprlib.Repr._repr_iterable(self, x, level, left, right,
+			maxiter, trail)
+
+
+	def repr_dict(self, x, level):
+		if len(x) > self.maxdict or (level <= 0 and len(x)):
+			self.__abbreviated = True
+		return reprlib.Repr.repr_dict(self, x, level)
+
+
+	def repr_str(self, x, level):
+		# Slice before calling repr, which for a long string would
+		# take long and use much memory.
+		text = repr(x[:self.maxstring])
+		if len(text) <= self.maxstring:
+			return text
+		self.__abbreviated = True
+		i = max(0, (self.maxstring - 3)//2)
+		j = max(0, self.maxstring - 3 - i)
+		text = repr(x[:i] + x[len(x) - j:])
+		return text[:i] + '...' + text[len(text) - j:]
+
+	repr_unicode = repr_bytes = repr_str
+
+
+	def repr_int(self, x, level):
+		return self.__abbreviate(repr(x), self.maxlong)
+
+	repr_long = repr_int
+
+
+	def __abbreviate(self, text, maxSize):
+		"""Replace the middle of text with '...' if it is too long."""
+		if len(text) <= maxSize:
+			return text
+		self.__abbreviated = True
+		i = max(0, (maxSize - 3)//2)
+		j = max(0, maxSize - 3 - i)
+		return text[:i] + '...' + text[len(text) - j:]
+
+
+
+def _IterRepr(value, pieceLength, active=None):
+	"""
+	Generate the repr of value in pieces, so that the reprs of strings,
+	containers and their items can be made a bit at a time. Strings are
+	split into pieces of pieceLength characters, as are the reprs of
+	other values, which can only be made whole.
+	"""
+	if active is None:
+		active = set()
+	valueType = type(value)
+	if valueType in (str, unicode):
+		for piece in _IterStringRepr(value, pieceLength):
+			yield piece
+		return
+	if valueType not in (list, tuple, dict, set, frozenset,
+	collections.deque):
+		text = repr(value)
+		for start in xrange(0, len(text), pieceLength):
+			yield text[start:start + pieceLength]
+		return
+	if not value:
+		yield repr(value)
+		return
+	if id(value) in active:
+		yield valueType is dict and '{...}' or '[...]'
+		return
+
+	active.add(id(value))
+	if valueType is dict:
+		yield '{'
+		for i, (k, v) in enumerate(value.iteritems()):
+			if i:
+				yield ', '
+			for piece in _IterRepr(k, pieceLength, active):
+				yield piece
+			yield ': '
+			for piece in _IterRepr(v, pieceLength, active):
+				yield piece
+		yield '}'
+	else:
+		if valueType is list:
+			left, right = '[', ']'
+		elif valueType is tuple:
+			left, right = '(', len(value) == 1 and ',)' or ')'
+		else:
+			left, right = valueType.__name__ + '([', '])'
+			if valueType is collections.deque and value.maxlen is not None:
+				right = '], maxlen=%d)' % value.maxlen
+		yield left
+		for i, item in enumerate(value):
+			if i:
+				yield ', '
+			for piece in _IterRepr(item, pieceLength, active):
+				yield piece
+		yield right
+	active.discard(id(value))
+
+
+def _IterStringRepr(value, pieceLength):
+	"""
+	Generate the repr of the string value in pieces, calling repr on
+	only pieceLength characters at a time.
+	"""
+	prefix = repr(value[:0])[:-2]
+	quote = ("'" in value and '"' not in value) and '"' or "'"
+	yield prefix + quote
+	for start in xrange(0, len(value), pieceLength):
+		text = repr(value[start:start + pieceLength])
+		if text[-1] != quote:
+			# The piece has only the kind of quote that the whole
+			# string's repr escapes.
+			text = text.replace(quote, '\\' + quote)
+		yield text[len(prefix) + 1:-1]
+	yield quote
+
+
+
+class DisplayHook(object):
+	"""
+	When in context, show values of expressions evaluated by the
+	entering thread with the given callback, instead of the original
+	sys.displayhook.
+	"""
+	def __init__(self, orig, cb):
+		self.__orig = orig
+		self.__cb = cb
+		self.__threadId = None
+
+
+	def __call__(self, value):
+		if self.__threadId == threading.current_thread().ident:
+			self.__cb(value)
+		else:
+			self.__orig(value)
+
+
+	def __enter__(self):
+		self.__threadId = threading.current_thread().ident
+
+
+	def __exit__(self, excType, excValue, tb):
+		self.__threadId = None
 
 
 
 class StdRedirect(object):
 	"""
-	When in context, redirect output to the given callback.
+	When in context, redirect output from the entering thread to the
+	given callback.
 	"""
 	def __init__(self, orig, cb):
 		self.__orig = orig
 		self.__cb = cb
-		self.__enabled = False
+		self.__threadId = None
 
 
 	def write(self, s):
-		if self.__enabled:
+		if self.__threadId == threading.current_thread().ident:
 			self.__cb(s)
 		else:
 			self.__orig.write(s)
 
 
 	def __enter__(self):
-		self.__enabled = True
+		self.__threadId = threading.current_thread().ident
 
 
 	def __exit__(self, excType, excValue, tb):
-		self.__enabled = False
+		self.__threadId = None
 
 
 
-class ScrollKeepOrFollowGuard(object):
+class ExecutionThread(QtCore.QThread):
 	"""
-	When the scrolled area of a QAbstractScrollArea grows vertically,
-	either stay at the bottom or stay at the non-bottom position.
+	Run submitted source text off the GUI thread, one submission at a
+	time and in the order submitted.
+
+	Signals:
+		executed	source text, whether an error occurred
+	"""
+	def __init__(self, runSource, parent=None):
+		"""
+		runSource is called with the source text of each submission
+		and whether to run it as a script, and returns whether an
+		error occurred.
+		"""
+		QtCore.QThread.__init__(self, parent)
+		self.__runSource = runSource
+		self.__queue = Queue.Queue()
+		self.__lock = threading.Lock()
+		self.__threadId = None
+		self.__current = None
+		self.__interruptPending = False
+
+
+	def submit(self, sourceText, asScript=False):
+		self.__queue.put((sourceText, asScript))
+
+
+	def stop(self):
+		"""
+		Discard queued submissions and stop after the current one.
+		"""
+		try:
+			while True:
+				self.__queue.get_nowait()
+		except Queue.Empty:
+			pass
+		self.__queue.put(None)
+
+
+	def interrupt(self):
+		"""
+		Raise KeyboardInterrupt in the running submission, if any.
+		"""
+		with self.__lock:
+			if self.__current is None or self.__interruptPending:
+				return
+			self.__interruptPending = True
+			ctypes.pythonapi.PyThreadState_SetAsyncExc(
+				ctypes.c_long(self.__threadId),
+				ctypes.py_object(KeyboardInterrupt))
+
+
+	def run(self):
+		self.__threadId = threading.current_thread().ident
+		while True:
+			try:
+				if not self.__runNext():
+					break
+			except KeyboardInterrupt:
+				# The interrupt arrived after the user code returned.
+				self.__finish(True)
+
+
+	def __runNext(self):
+		submission = self.__queue.get()
+		if submission is None:
+			return False
+		sourceText, asScript = submission
+		with self.__lock:
+			self.__current = sourceText
+		try:
+			errorOccurred = self.__runSource(sourceText, asScript)
+		except KeyboardInterrupt:
+			errorOccurred = True
+		except BaseException as e:
+			# runcode passes SystemExit on; it ends only the submission.
+			log.warning('%s ended a background execution'
+				% e.__class__.__name__)
+			errorOccurred = True
+		self.__finish(errorOccurred)
+		return True
+
+
+	def __finish(self, errorOccurred):
+		sourceText = None
+		try:
+			with self.__lock:
+				if self.__interruptPending:
+					# Cancel an interrupt not yet delivered, so it can't
+					#	land outside the submission it was meant for.
+					ctypes.pythonapi.PyThreadState_SetAsyncExc(
+						ctypes.c_long(self.__threadId), None)
+					self.__interruptPending = False
+				sourceText, self.__current = self.__current, None
+		finally:
+			# Even if a late interrupt landed above: run() then calls
+			# __finish again, which finds nothing left to report.
+			if sourceText is not None:
+				self.emit(QtCore.SIGNAL('executed'),
+					sourceText, errorOccurred)
+
+
+
+class OutputBuffer(QtCore.QObject):
+	"""
+	Collect styled text bound for the end of a QTextEdit and insert it
+	in batches.
+
+	append() may be called from any thread; text is only inserted on the
+	thread which created the buffer (the GUI thread).
+
+	Adjacent fragments with the same format are merged into one run.
+	Pending runs are inserted in a single edit block when the flush timer
+	fires, when more than MAX_PENDING_CHARS are waiting, or when flush()
+	is called explicitly.
+
+	If a maximum scrollback is set, the oldest blocks are removed after
+	a flush pushes the document past the limit. Trimming goes down to
+	TRIM_RATIO of the limit so that it happens in bulk, not on every
+	flush.
+	"""
+	FLUSH_INTERVAL_MS = 50
+	MAX_PENDING_CHARS = 64*1024
+	TRIM_RATIO = 0.8
+
+
+	def __init__(self, textEdit):
+		QtCore.QObject.__init__(self, textEdit)
+		self.__textEdit = textEdit
+		self.__guiThreadId = threading.current_thread().ident
+		self.__lock = threading.Lock()
+		self.__pending = []
+		self.__pendingChars = 0
+		self.__maxBlocks = None
+		self.__maxChars = None
+		self.__scrollFollower = ScrollFollower(textEdit)
+
+		self.__timer = QtCore.QTimer(textEdit)
+		self.__timer.setSingleShot(True)
+		self.__timer.setInterval(self.FLUSH_INTERVAL_MS)
+		QtCore.QObject.connect(self.__timer,
+			QtCore.SIGNAL('timeout()'), self.flush)
+		QtCore.QObject.connect(self, QtCore.SIGNAL('pending'),
+			self.__schedule)
+
+
+	def append(self, text, format):
+		if not text:
+			return
+		with self.__lock:
+			wasEmpty = not self.__pending
+			if self.__pending and self.__pending[-1][1] is format:
+				self.__pending[-1][0].append(text)
+			else:
+				self.__pending.append(([text], format))
+			self.__pendingChars += len(text)
+			full = self.__pendingChars >= self.MAX_PENDING_CHARS
+
+		if threading.current_thread().ident != self.__guiThreadId:
+			if wasEmpty:
+				# Queued across threads to __schedule.
+				self.emit(QtCore.SIGNAL('pending'))
+		elif full:
+			self.flush()
+		else:
+			self.__schedule()
+
+
+	def __schedule(self):
+		if not self.__timer.isActive():
+			self.__timer.start()
+
+
+	def setMaximumScrollback(self, blocks=None, characters=None):
+		self.__maxBlocks = blocks
+		self.__maxChars = characters
+		with self.__scrollFollower as follower:
+			self.__trim(follower)
+
+
+	def flush(self):
+		"""Insert all pending text now."""
+		self.__timer.stop()
+		with self.__lock:
+			pending = self.__pending
+			self.__pending = []
+			self.__pendingChars = 0
+		if not pending:
+			return
+
+		with self.__scrollFollower as follower:
+			cursor = QtGui.QTextCursor(self.__textEdit.document())
+			cursor.movePosition(QtGui.QTextCursor.End)
+			cursor.beginEditBlock()
+			for fragments, format in pending:
+				cursor.insertText(''.join(fragments), format)
+			cursor.endEditBlock()
+			self.__trim(follower)
+
+
+	def __trim(self, follower):
+		"""
+		Remove the oldest blocks if the document is over a limit,
+		and tell the scroll follower how much height was removed.
+		"""
+		doc = self.__textEdit.document()
+		firstKept = None
+
+		if self.__maxBlocks and doc.blockCount() > self.__maxBlocks:
+			nKeep = max(1, int(self.__maxBlocks*self.TRIM_RATIO))
+			firstKept = doc.findBlockByNumber(
+				doc.blockCount() - nKeep)
+
+		if self.__maxChars and doc.characterCount() > self.__maxChars:
+			nRemove = doc.characterCount() \
+				- int(self.__maxChars*self.TRIM_RATIO)
+			block = doc.findBlock(nRemove)
+			if block.position() < nRemove:
+				block = block.next()
+			if not block.isValid():
+				block = doc.lastBlock()
+			if (firstKept is None
+			or block.position() > firstKept.position()):
+				firstKept = block
+
+		if firstKept is None or firstKept.position() == 0:
+			return
+
+		follower.contentRemoved(doc.documentLayout()
+			.blockBoundingRect(firstKept).top())
+		cursor = QtGui.QTextCursor(doc)
+		cursor.setPosition(firstKept.position(),
+			QtGui.QTextCursor.KeepAnchor)
+		cursor.removeSelectedText()
+
+
+
+class ScrollFollower(QtCore.QObject):
+	"""
+	Keep a QAbstractScrollArea scrolled to the bottom as its content
+	grows, if it was at the bottom; otherwise leave it where it is.
+
+	Whether the area is at the bottom is tracked from its vertical
+	scroll bar's signals, so nothing is measured per change. Content
+	changes may be batched with beginBatch() and endBatch() (or by
+	using the follower as a context manager): the viewport is not
+	repainted during a batch, and the position is restored once at the
+	end. If content is removed from the top during a batch, report its
+	height with contentRemoved() so that a position away from the
+	bottom stays on the same content.
 	"""
 	def __init__(self, scrollArea):
+		QtCore.QObject.__init__(self, scrollArea)
 		self.__scrollArea = scrollArea
+		self.__scrollBar = scrollArea.verticalScrollBar()
+		self.__atBottom = True
+		self.__batchDepth = 0
+		self.__removedHeight = 0
+		self.__value = self.__scrollBar.value()
+
+		QtCore.QObject.connect(self.__scrollBar,
+			QtCore.SIGNAL('valueChanged(int)'), self.__valueChanged)
+		QtCore.QObject.connect(self.__scrollBar,
+			QtCore.SIGNAL('rangeChanged(int, int)'), self.__rangeChanged)
+
+
+	def isAtBottom(self):
+		return self.__atBottom
+
+
+	def beginBatch(self):
+		self.__batchDepth += 1
+		if self.__batchDepth == 1:
+			self.__removedHeight = 0
+			self.__scrollArea.viewport().setUpdatesEnabled(False)
+
+
+	def contentRemoved(self, height):
+		self.__removedHeight += height
+
+
+	def endBatch(self):
+		self.__batchDepth -= 1
+		if self.__batchDepth > 0:
+			return
+		if self.__atBottom:
+			self.__scrollBar.setValue(self.__scrollBar.maximum())
+		elif self.__removedHeight:
+			self.__scrollBar.setValue(
+				max(0, self.__value - int(self.__removedHeight)))
+		self.__value = self.__scrollBar.value()
+		self.__scrollArea.viewport().setUpdatesEnabled(True)
 
 
 	def __enter__(self):
-		# Save the relative scroll position.
-		vbar = self.__scrollArea.verticalScrollBar()
-
-		vmin, vval, vmax = vbar.minimum(), vbar.value(), vbar.maximum()
-		nPages = (vmax-vmin)/float(vbar.pageStep())
-		self.__origH = self.__scrollArea.viewport().height() * nPages
-		if (vmax > vmin):
-			origF = float(vval-vmin)/(vmax-vmin)
-		else:
-			origF = 0
-		self.__origEndOffset = (1.0-origF)*self.__origH
+		self.beginBatch()
+		return self
 
 
 	def __exit__(self, excType, excValue, tb):
-		# Restore the scroll position.
-		vbar = self.__scrollArea.verticalScrollBar()
+		self.endBatch()
 
-		vmin, vmax = vbar.minimum(), vbar.maximum()
-		if vmax <= vmin:
-			return
 
-		nPages = (vmax-vmin)/float(vbar.pageStep())
-		newH = self.__scrollArea.viewport().height() * nPages
+	def __valueChanged(self, value):
+		if self.__batchDepth:
+			# Moved by the changing content, not by the user.
+			return
+		self.__value = value
+		self.__atBottom = value >= self.__scrollBar.maximum()
 
-		lineSpacing = self.__scrollArea.fontMetrics().lineSpacing()
-		if self.__origEndOffset < lineSpacing:
-			# If within a line of the bottom, follow new text.
-			newTopOffset = newH - self.__origEndOffset
-		else:
-			# Otherwise, stay at old location.
-			newTopOffset = self.__origH - self.__origEndOffset
 
-		newF = newTopOffset/float(newH)
-		vval = newF*(vmax-vmin)
-		vbar.setValue(vval)
+	def __rangeChanged(self, minimum, maximum):
+		# Layout may finish after a batch, so follow here too.
+		if self.__atBottom and not self.__batchDepth:
+			self.__scrollBar.setValue(maximum)
 
 
 
@@ -298,7 +1323,20 @@ class PythonInputWidget(QtGui.QTextEdit):
 	"""
 	Signals:
 		execute		text (Python code to execute)
+		executeScript	text (Python code to run as a script)
 		completions	list of possible completions
+		interrupt	(no arguments) stop running code
+		searchStatus	text describing the history search, or '' when
+				not searching
+
+	Ctrl+Return or Enter executes the input (or the selection) a
+	statement at a time; Shift+Return or Shift+Enter runs it as one
+	script, which is faster for long input.
+
+	Ctrl+R starts an incremental history search; typing refines it,
+	Ctrl+R again shows the next older match, and Escape cancels.
+
+	The input is highlighted as Python by a PythonHighlighter.
 	"""
 	__SETTINGS_GROUP_NAME = 'PythonInputWidget'
 	__SETTINGS_NAME_HISTORY = 'history'
@@ -311,20 +1349,42 @@ class PythonInputWidget(QtGui.QTextEdit):
 		self.__commandHistoryIndex = None
 		self.__swapText = None
 
-		self.__completer = rlcompleter.Completer()
-		self.__completer.use_main_ns = False
-		self.__completer.namespace = locals
+		self.__searchIndex = None
+		self.__searchQuery = None
+		self.__searchMatches = []
+		self.__searchMatchIndex = 0
+		self.__searchSwapText = None
+
+		self.__completionIndex = CompletionIndex(locals)
+		self.__completionFunction = None
+
+		self.__historyStore = None
 
-		self.__historyView = QtGui.QTextEdit(None)
-		self.__historyView.setWindowTitle('Command History')
-		self.__historyView.setReadOnly(True)
+		self.__historyView = None
+		self.__historyGeometry = _WidgetGeometry()
+
+		self.__highlighter = PythonHighlighter(self.document(),
+			self.palette())
+
+
+	def changeEvent(self, event):
+		if event.type() == QtCore.QEvent.PaletteChange:
+			self.__highlighter.setPalette(self.palette())
+		QtGui.QTextEdit.changeEvent(self, event)
 
 
 	def keyPressEvent(self, event):
 		k = event.key()
 		mods = event.modifiers()
 
-		if ((k == QtCore.Qt.Key_Enter) or (k == QtCore.Qt.Key_Return
+		if self.__searchQuery is not None and self.__searchKeyPress(event):
+			return
+		elif (k in (QtCore.Qt.Key_Enter, QtCore.Qt.Key_Return)
+		and mods & QtCore.Qt.ShiftModifier
+		and not event.isAutoRepeat()):
+			self.__execute(asScript=True)
+			return
+		elif ((k == QtCore.Qt.Key_Enter) or (k == QtCore.Qt.Key_Return
 		and mods & (QtCore.Qt.ControlModifier|QtCore.Qt.MetaModifier))
 		and not event.isAutoRepeat()):
 			self.__execute()
@@ -344,10 +1404,96 @@ class PythonInputWidget(QtGui.QTextEdit):
 		& (QtCore.Qt.ControlModifier|QtCore.Qt.MetaModifier))):
 			self.__clearCurrentLineOrDocument()
 			return
+		elif ((k == QtCore.Qt.Key_C) and (mods
+		& (QtCore.Qt.ControlModifier|QtCore.Qt.MetaModifier))
+		and not self.textCursor().hasSelection()):
+			self.emit(QtCore.SIGNAL('interrupt'))
+			return
+		elif ((k == QtCore.Qt.Key_R) and (mods
+		& (QtCore.Qt.ControlModifier|QtCore.Qt.MetaModifier))):
+			self.__searchHistory()
+			return
 
 		return QtGui.QTextEdit.keyPressEvent(self, event)
 
 
+	def focusOutEvent(self, event):
+		if self.__searchQuery is not None:
+			self.__endHistorySearch(True)
+		return QtGui.QTextEdit.focusOutEvent(self, event)
+
+
+	def __searchKeyPress(self, event):
+		"""
+		Handle a key press during a history search. Return whether
+		the key press has been consumed.
+		"""
+		k = event.key()
+		mods = event.modifiers()
+		commandMods = mods & (QtCore.Qt.ControlModifier
+			|QtCore.Qt.MetaModifier|QtCore.Qt.AltModifier)
+		text = unicode(event.text())
+
+		if k == QtCore.Qt.Key_R and commandMods:
+			return False
+		elif k == QtCore.Qt.Key_Escape or (k == QtCore.Qt.Key_G
+		and commandMods):
+			self.__endHistorySearch(False)
+		elif k == QtCore.Qt.Key_Return and not commandMods:
+			self.__endHistorySearch(True)
+		elif k == QtCore.Qt.Key_Backspace:
+			self.__setSearchQuery(self.__searchQuery[:-1])
+		elif (text and not commandMods and k != QtCore.Qt.Key_Tab
+		and ord(text[0]) >= 0x20):
+			self.__setSearchQuery(self.__searchQuery + text)
+		else:
+			self.__endHistorySearch(True)
+			return False
+		return True
+
+
+	def __searchHistory(self):
+		if self.__searchIndex is None:
+			self.__searchIndex = HistorySearchIndex(
+				self.__commandHistory)
+		if self.__searchQuery is None:
+			self.__searchSwapText = self.__getPlainText()
+			self.__setSearchQuery('')
+		else:
+			self.__showSearchMatch(self.__searchMatchIndex + 1)
+
+
+	def __setSearchQuery(self, query):
+		self.__searchQuery = query
+		self.__searchMatches = self.__searchIndex.search(query)
+		self.__showSearchMatch(0)
+
+
+	def __showSearchMatch(self, i):
+		n = len(self.__searchMatches)
+		if i < n:
+			self.__searchMatchIndex = i
+			self.setPlainText(self.__searchMatches[i])
+			self.moveCursor(QtGui.QTextCursor.End)
+			status = "(reverse-i-search) '%s': %d of %d" % (
+				self.__searchQuery, i + 1, n)
+		else:
+			status = "(failed reverse-i-search) '%s'" % (
+				self.__searchQuery,)
+		self.emit(QtCore.SIGNAL('searchStatus'), status)
+
+
+	def __endHistorySearch(self, accept):
+		if not accept:
+			self.setPlainText(self.__searchSwapText)
+			self.moveCursor(QtGui.QTextCursor.End)
+		self.__searchQuery = None
+		self.__searchMatches = []
+		self.__searchSwapText = None
+		self.__commandHistoryIndex = None
+		self.emit(QtCore.SIGNAL('searchStatus'), '')
+
+
 	def __getPlainText(self, selectionOnly=False, cursor=None):
 		if selectionOnly:
 			# Selection doesn't do a to-plain conversion, so (for
@@ -393,40 +1539,68 @@ class PythonInputWidget(QtGui.QTextEdit):
 		cursor.removeSelectedText()
 
 
-	def __appendCommandHistory(self, text):
-		if not self.__historyView.document().isEmpty():
-			self.__historyView.moveCursor(QtGui.QTextCursor.End)
-			historyText = '\n\n' + text
+	def __appendCommandHistory(self, texts):
+		if not texts:
+			return
+		if self.__historyView is None:
+			self.__commandHistory.extend(texts)
 		else:
-			historyText = text
-		with ScrollKeepOrFollowGuard(self.__historyView):
-			self.__historyView.insertPlainText(historyText)
-		self.__commandHistory.append(text)
+			self.__historyView.extend(texts)
+		if self.__searchIndex is not None:
+			for text in texts:
+				self.__searchIndex.add(text)
+
+
+	def setHistoryStore(self, historyStore):
+		"""
+		Keep history in historyStore (a HistoryStore) instead of in
+		the settings passed to writeSettings. The store's entries are
+		loaded now; if it is empty, it is seeded with the current
+		history.
+		"""
+		self.__historyStore = historyStore
+		entries = historyStore.load()
+		if entries:
+			del self.__commandHistory[:]
+			self.__searchIndex = None
+			if self.__historyView is not None:
+				self.__historyView.reset()
+			self.__appendCommandHistory(entries)
+		else:
+			historyStore.extend(self.__commandHistory)
+		self.__commandHistoryIndex = None
 
 
-	def executionComplete(self):
+	def executionComplete(self, text=None):
 		"""
-		Execution has completed successfully.
-		Store history and clear as appropriate.
+		Execution of text (by default, the current input) has completed
+		successfully. Store history and clear as appropriate.
 		"""
 		hasSelection = self.textCursor().hasSelection()
-		text = self.__getPlainText(selectionOnly=hasSelection)
-		if not hasSelection:
+		currentText = self.__getPlainText(selectionOnly=hasSelection)
+		if text is None:
+			text = currentText
+		if not hasSelection and currentText == text:
 			self.clear()
 
 		if not (self.__commandHistory
 		and self.__commandHistory[-1] == text):
-			self.__appendCommandHistory(text)
+			self.__appendCommandHistory([text])
+			if self.__historyStore is not None:
+				self.__historyStore.append(text)
 		self.__commandHistoryIndex = None
 
 
-	def __execute(self):
+	def __execute(self, asScript=False):
 		text = self.__getPlainText(
 			selectionOnly=self.textCursor().hasSelection())
 		if not text:
 			return
 
-		self.emit(QtCore.SIGNAL('execute'), text)
+		if asScript:
+			self.emit(QtCore.SIGNAL('executeScript'), text)
+		else:
+			self.emit(QtCore.SIGNAL('execute'), text)
 
 
 	def __shouldAutoComplete(self):
@@ -478,13 +1652,7 @@ class PythonInputWidget(QtGui.QTextEdit):
 
 		text = self.__getPlainText(cursor=cursor, selectionOnly=True)
 
-		completions = []
-		i = 0
-		completion = self.__completer.complete(text, i)
-		while completion is not None:
-			completions.append(completion)
-			i += 1
-			completion = self.__completer.complete(text, i)
+		completions = self.__getCompletions(text)
 
 		replacement = None
 		if not completions:
@@ -500,6 +1668,28 @@ class PythonInputWidget(QtGui.QTextEdit):
 			cursor.insertText(replacement)
 
 
+	def setCompletionFunction(self, completionFunction):
+		"""
+		Complete with completionFunction(text) -> list of completions,
+		or from this widget's locals if completionFunction is None.
+		"""
+		self.__completionFunction = completionFunction
+
+
+	def __getCompletions(self, text):
+		if self.__completionFunction is not None:
+			return self.__completionFunction(text)
+		return self.__completionIndex.complete(text)
+
+
+	def namespaceChanged(self):
+		"""
+		Code has run, and may have changed the namespace used for
+		completion.
+		"""
+		self.__completionIndex.namespaceChanged()
+
+
 	def __showHistory(self, older):
 		if not self.__commandHistory:
 			return
@@ -537,26 +1727,51 @@ class PythonInputWidget(QtGui.QTextEdit):
 
 
 	def showAllHistory(self):
-		baseFont = self.font()
-		# f = QtGui.QFont(baseFont) produces different (no) results.
-		f = QtGui.QFont()
-		f.setFixedPitch(baseFont.fixedPitch())
-		f.setPointSize(baseFont.pointSize())
-		f.setFamily(baseFont.family())
-		self.__historyView.setFont(f)
+		if self.__historyView is None:
+			self.__historyView = HistoryView(self.__commandHistory)
+			QtCore.QObject.connect(self.__historyView,
+				QtCore.SIGNAL('entryActivated'), self.__useHistoryEntry)
+			self.__historyGeometry.applyTo(self.__historyView)
+
+			baseFont = self.font()
+			# f = QtGui.QFont(baseFont) produces different (no)
+			#	results.
+			f = QtGui.QFont()
+			f.setFixedPitch(baseFont.fixedPitch())
+			f.setPointSize(baseFont.pointSize())
+			f.setFamily(baseFont.family())
+			self.__historyView.setFont(f)
 
 		self.__historyView.show()
+		self.__historyView.raise_()
+
+
+	def __useHistoryEntry(self, text):
+		self.setPlainText(text)
+		self.moveCursor(QtGui.QTextCursor.End)
+		self.__commandHistoryIndex = None
+		self.setFocus()
+
+
+	def __getHistoryGeometryWidget(self):
+		if self.__historyView is None:
+			return self.__historyGeometry
+		return self.__historyView
 
 
 	def readSettings(self, settings):
-		with Settings.GroupGuard(settings, self.__SETTINGS_GROUP_NAME):
-			with Settings.ArrayReadGuard(settings,
+		snapshot = Settings.ReadSnapshot(settings,
+			self.__SETTINGS_GROUP_NAME)
+		if self.__historyStore is None:
+			with Settings.ArrayReadGuard(snapshot,
 			self.__SETTINGS_NAME_HISTORY) as n:
-				for i in xrange(n):
-					self.__readHistorySetting(settings, i)
-			Settings.ReadWidgetGeometry(settings,
-				self.__SETTINGS_NAME_HISTORY_GEOMETRY,
-				self.__historyView)
+				history = [self.__readHistorySetting(snapshot, i)
+					for i in xrange(n)]
+			self.__appendCommandHistory(
+				[h for h in history if h is not None])
+		Settings.ReadWidgetGeometry(snapshot,
+			self.__SETTINGS_NAME_HISTORY_GEOMETRY,
+			self.__getHistoryGeometryWidget())
 
 
 	def __readHistorySetting(self, settings, i):
@@ -564,21 +1779,25 @@ class PythonInputWidget(QtGui.QTextEdit):
 		qv = settings.value(self.__SETTINGS_NAME_HISTORY_ENTRY)
 		qstr = qv.toString()
 		if not qstr.isNull():
-			self.__appendCommandHistory(str(qstr))
+			return str(qstr)
+		return None
 
 
 	def writeSettings(self, settings):
 		with Settings.GroupGuard(settings, self.__SETTINGS_GROUP_NAME):
-			with Settings.ArrayWriteGuard(settings,
-			self.__SETTINGS_NAME_HISTORY):
-				history = self.__commandHistory[
-					-self.MAX_SAVED_HISTORY:]
-				for i, h in enumerate(history):
-					self.__writeHistorySetting(
-						settings, i, h)
+			if self.__historyStore is None:
+				with Settings.ArrayWriteGuard(settings,
+				self.__SETTINGS_NAME_HISTORY):
+					history = self.__commandHistory[
+						-self.MAX_SAVED_HISTORY:]
+					for i, h in enumerate(history):
+						self.__writeHistorySetting(
+							settings, i, h)
+			else:
+				settings.remove(self.__SETTINGS_NAME_HISTORY)
 			Settings.WriteWidgetGeometry(settings,
 				self.__SETTINGS_NAME_HISTORY_GEOMETRY,
-				self.__historyView)
+				self.__getHistoryGeometryWidget())
 
 
 	def __writeHistorySetting(self, settings, i, historyEntry):
@@ -588,3 +1807,131 @@ class PythonInputWidget(QtGui.QTextEdit):
 
 
 
+class _WidgetGeometry(object):
+	"""
+	Hold the position and size of a widget which has not been created
+	yet, for use with the Settings geometry functions.
+	"""
+	def __init__(self):
+		self.__pos = QtCore.QPoint()
+		self.__size = QtCore.QSize()
+
+
+	def pos(self):
+		return self.__pos
+
+
+	def size(self):
+		return self.__size
+
+
+	def move(self, pos):
+		self.__pos = pos
+
+
+	def resize(self, size):
+		self.__size = size
+
+
+	def applyTo(self, widget):
+		if not self.__pos.isNull():
+			widget.move(self.__pos)
+		if self.__size.isValid():
+			widget.resize(self.__size)
+
+
+
+class HistoryModel(QtCore.QAbstractListModel):
+	"""
+	List model over a list of history entries, shared with (and only
+	appended to through) this model. Multi-line entries are displayed
+	as their first line; the whole entry is in Qt.ToolTipRole and
+	Qt.UserRole.
+	"""
+	def __init__(self, entries, parent=None):
+		QtCore.QAbstractListModel.__init__(self, parent)
+		self.__entries = entries
+
+
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.__entries)
+
+
+	def data(self, index, role=QtCore.Qt.DisplayRole):
+		if not index.isValid():
+			return QtCore.QVariant()
+		text = self.__entries[index.row()]
+		if role == QtCore.Qt.DisplayRole:
+			firstLine, newline, rest = text.partition('\n')
+			if newline:
+				firstLine += ' ...'
+			return QtCore.QVariant(firstLine)
+		elif role in (QtCore.Qt.ToolTipRole, QtCore.Qt.UserRole):
+			return QtCore.QVariant(text)
+		return QtCore.QVariant()
+
+
+	def extend(self, texts):
+		n = len(self.__entries)
+		self.beginInsertRows(QtCore.QModelIndex(), n, n + len(texts) - 1)
+		self.__entries.extend(texts)
+		self.endInsertRows()
+
+
+
+class HistoryView(QtGui.QWidget):
+	"""
+	Window listing command history, with a filter field. Only visible
+	rows are laid out, so the size of the history doesn't matter.
+
+	Signals:
+		entryActivated	text of a double-clicked entry
+	"""
+	def __init__(self, entries, parent=None):
+		QtGui.QWidget.__init__(self, parent)
+		self.setWindowTitle('Command History')
+		layout = QtGui.QVBoxLayout(self)
+
+		self.__filterField = QtGui.QLineEdit(self)
+		self.__filterField.setToolTip('Show entries containing this')
+		layout.addWidget(self.__filterField)
+
+		self.__model = HistoryModel(entries, self)
+		self.__filterModel = QtGui.QSortFilterProxyModel(self)
+		self.__filterModel.setSourceModel(self.__model)
+		self.__filterModel.setFilterRole(QtCore.Qt.UserRole)
+		self.__filterModel.setFilterCaseSensitivity(
+			QtCore.Qt.CaseInsensitive)
+
+		self.__listView = QtGui.QListView(self)
+		self.__listView.setModel(self.__filterModel)
+		self.__listView.setUniformItemSizes(True)
+		self.__listView.setEditTriggers(
+			QtGui.QAbstractItemView.NoEditTriggers)
+		layout.addWidget(self.__listView)
+		self.__listView.scrollToBottom()
+		self.__scrollFollower = ScrollFollower(self.__listView)
+
+		QtCore.QObject.connect(self.__filterField,
+			QtCore.SIGNAL('textChanged(const QString &)'),
+			self.__filterModel.setFilterFixedString)
+		QtCore.QObject.connect(self.__listView,
+			QtCore.SIGNAL('doubleClicked(const QModelIndex &)'),
+			self.__activate)
+
+
+	def extend(self, texts):
+		with self.__scrollFollower:
+			self.__model.extend(texts)
+
+
+	def reset(self):
+		"""The underlying list of entries was changed in place."""
+		self.__model.reset()
+
+
+	def __activate(self, index):
+		text = unicode(index.data(QtCore.Qt.UserRole).toString())
+		self.emit(QtCore.SIGNAL('entryActivated'), text)
@@ -0,0 +1,300 @@
+"""
+Run console code in a child process on behalf of SubprocessKernel.
+
+This is run as a script and uses only the standard library. Requests
+are read from stdin and replies written to the original stdout, one JSON
+object per line:
+
+	parent -> child
+		{"type": "execute", "id": n, "source": text, "script": bool}
+		{"type": "complete", "id": n, "text": text}
+	child -> parent
+		{"type": "output", "stream": name, "text": text}
+		{"type": "executed", "id": n, "error": bool}
+		{"type": "completions", "id": n, "completions": [text, ...]}
+
+Stream names are 'stdout', 'stderr' and 'context' (echoed input). With
+"script" true, the source is run as one module rather than a statement
+at a time.
+Completion requests are answered while code is running, from a
+CompletionIndex over the child's namespace.
+"""
+
+import code, json, os, signal, sys, threading, time, traceback, Queue
+from Completion import CompletionIndex
+from CodeCache import CodeCache, SplitStatements
+import MagicCommands
+
+if not hasattr(sys, 'ps1'):
+	sys.ps1 = '>>> '
+if not hasattr(sys, 'ps2'):
+	sys.ps2 = '... '
+
+TB_HEADER = 'Traceback (most recent call last):'
+FLUSH_INTERVAL_S = 0.05
+
+
+
+class Channel(object):
+	"""
+	Send messages to the parent from any thread. Writes are buffered,
+	and flushed periodically or on request.
+	"""
+	def __init__(self, outFile):
+		self.__file = outFile
+		self.__lock = threading.Lock()
+		flusher = threading.Thread(target=self.__flushPeriodically)
+		flusher.daemon = True
+		flusher.start()
+
+
+	def send(self, **message):
+		line = json.dumps(message) + '\n'
+		with self.__lock:
+			self.__file.write(line)
+
+
+	def flush(self):
+		with self.__lock:
+			self.__file.flush()
+
+
+	def __flushPeriodically(self):
+		while True:
+			time.sleep(FLUSH_INTERVAL_S)
+			self.flush()
+
+
+
+class ChannelStream(object):
+	"""File-like object that sends what is written as output."""
+	def __init__(self, channel, streamName):
+		self.__channel = channel
+		self.__streamName = streamName
+
+
+	def write(self, text):
+		if isinstance(text, bytes):
+			# json.dumps takes byte strings as UTF-8, and fails on
+			# others.
+			text = text.decode('utf-8', 'replace')
+		if text:
+			self.__channel.send(type='output',
+				stream=self.__streamName, text=text)
+
+
+	def flush(self):
+		pass
+
+
+
+class Interpreter(code.InteractiveInterpreter):
+	"""
+	Run source the way InteractivePythonWidget does in-process,
+	echoing each line before running it.
+	"""
+	def __init__(self, channel):
+		code.InteractiveInterpreter.__init__(self,
+			{'__name__': '__console__', '__doc__': None})
+		self.__context = ChannelStream(channel, 'context')
+		self.__error = ChannelStream(channel, 'stderr')
+		self.__errorOccurred = False
+		self.__codeCache = CodeCache(self.compile.compiler)
+
+
+	def runSourceGradually(self, sourceText):
+		"""Run sourceText, and return whether an error occurred."""
+		self.__errorOccurred = False
+		statements = SplitStatements(sourceText)
+		if statements is None:
+			self.__runLinesGradually(sourceText)
+		else:
+			self.__runStatements(sourceText.split('\n'), statements)
+		return self.__errorOccurred
+
+
+	def runScript(self, sourceText):
+		"""
+		Run sourceText as one module, echoing only its first line, and
+		return whether an error occurred.
+		"""
+		self.__errorOccurred = False
+		lines = sourceText.split('\n')
+		self.__context.write('%s%s\n' % (sys.ps1, lines[0]))
+		if len(lines) > 1:
+			self.__context.write('%s(%d more lines)\n'
+				% (sys.ps2, len(lines) - 1))
+		try:
+			codeObject = self.__codeCache.compileScript(sourceText)
+		except (OverflowError, SyntaxError, ValueError):
+			self.showsyntaxerror()
+		else:
+			self.runcode(codeObject)
+		return self.__errorOccurred
+
+
+	def __runStatements(self, lines, statements):
+		echoed = 0
+		for start, end in statements:
+			echoLines = ['%s%s\n' % (sys.ps1, line)
+				for line in lines[echoed:start + 1]]
+			echoLines.extend(['%s%s\n' % (sys.ps2, line)
+				for line in lines[start + 1:end]])
+			self.__context.write(''.join(echoLines))
+			echoed = end
+
+			if end - start == 1 and MagicCommands.IsMagic(lines[start]):
+				self.__runMagic(lines[start])
+			else:
+				self.__runCompiled('\n'.join(lines[start:end]) + '\n')
+			if self.__errorOccurred:
+				return
+		self.__context.write(''.join(['%s%s\n' % (sys.ps1, line)
+			for line in lines[echoed:]]))
+
+
+	def __runCompiled(self, source):
+		try:
+			codeObject = self.__codeCache.compile(source)
+		except (OverflowError, SyntaxError, ValueError):
+			self.showsyntaxerror()
+			return
+		self.runcode(codeObject)
+
+
+	def __runLinesGradually(self, sourceText):
+		lines = sourceText.split('\n')
+		buffer = ''
+		for line in lines:
+			if buffer:
+				prompt = sys.ps2
+			else:
+				prompt = sys.ps1
+			self.__context.write('%s%s\n' % (prompt, line))
+
+			if not buffer and MagicCommands.IsMagic(line):
+				self.__runMagic(line)
+				if self.__errorOccurred:
+					break
+				continue
+			buffer += '\n' + line
+			if not self.runsource(buffer):
+				buffer = ''
+			if self.__errorOccurred:
+				break
+		if buffer:
+			buffer += '\n'
+			if self.runsource(buffer):
+				self.__errorOccurred = True
+				self.__error.write('Input incomplete.')
+
+
+	def __runMagic(self, line):
+		try:
+			sys.stdout.write(MagicCommands.RunMagic(line, self.locals))
+		except (MagicCommands.MagicError, SyntaxError):
+			self.showsyntaxerror()
+		except SystemExit:
+			raise
+		except:
+			self.showtraceback()
+
+
+	def write(self, text):
+		self.__error.write(text)
+
+
+	def showsyntaxerror(self, filename=None):
+		self.__errorOccurred = True
+		excClass, excObj, tb = sys.exc_info()
+		for line in traceback.format_exception_only(excClass, excObj):
+			self.__error.write(line)
+
+
+	def showtraceback(self):
+		self.__errorOccurred = True
+		excClass, excObj, tb = sys.exc_info()
+		self.__error.write(TB_HEADER)
+		self.__error.write('\n'.join(traceback.format_tb(tb)[1:]))
+		for line in traceback.format_exception_only(excClass, excObj):
+			self.__error.write(line)
+
+
+
+def _IgnoreInterrupt(signum, frame):
+	pass
+
+
+def ReadRequests(inFile, channel, completionIndex, executeQueue):
+	"""
+	Answer completion requests immediately, and queue the rest for
+	the main thread. Queue None when the parent closes our stdin.
+	"""
+	for line in iter(inFile.readline, ''):
+		request = json.loads(line)
+		if request['type'] == 'complete':
+			try:
+				completions = completionIndex.complete(
+					request['text'])
+			except Exception:
+				# For example, the namespace changed size while
+				#	being indexed by running code.
+				completions = []
+			channel.send(type='completions', id=request['id'],
+				completions=completions)
+			channel.flush()
+		else:
+			executeQueue.put(request)
+	executeQueue.put(None)
+
+
+def Main():
+	# Keep the protocol streams for ourselves. Anything written directly
+	#	to file descriptor 1 (by extension modules, for example) goes to
+	#	stderr instead of corrupting replies.
+	channel = Channel(os.fdopen(os.dup(1), 'w'))
+	os.dup2(2, 1)
+	inFile = sys.stdin
+	sys.stdin = open(os.devnull)
+	sys.stdout = ChannelStream(channel, 'stdout')
+	sys.stderr = ChannelStream(channel, 'stderr')
+
+	interpreter = Interpreter(channel)
+	completionIndex = CompletionIndex(interpreter.locals)
+	executeQueue = Queue.Queue()
+	reader = threading.Thread(target=ReadRequests,
+		args=(inFile, channel, completionIndex, executeQueue))
+	reader.daemon = True
+	reader.start()
+	# SIGINT raises KeyboardInterrupt only while user code runs; one
+	#	arriving while replying would kill the process.
+	signal.signal(signal.SIGINT, _IgnoreInterrupt)
+
+	while True:
+		request = executeQueue.get()
+		if request is None:
+			break
+		errorOccurred = True
+		try:
+			signal.signal(signal.SIGINT, signal.default_int_handler)
+			try:
+				if request.get('script'):
+					errorOccurred = interpreter.runScript(
+						request['source'])
+				else:
+					errorOccurred = interpreter.runSourceGradually(
+						request['source'])
+			finally:
+				signal.signal(signal.SIGINT, _IgnoreInterrupt)
+		except KeyboardInterrupt:
+			# Interrupted outside of user code.
+			sys.stderr.write('KeyboardInterrupt\n')
+		completionIndex.namespaceChanged()
+		channel.send(type='executed', id=request['id'],
+			error=errorOccurred)
+		channel.flush()
+
+
+
+if __name__ == '__main__':
+	Main()
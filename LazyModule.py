@@ -0,0 +1,98 @@
+"""
+Defer imports until the names that need them are first used.
+
+Uses only the standard library.
+"""
+
+__all__ = [
+	'LazyModule',
+	'ImportModule',
+	'ImportFrom',
+]
+
+import importlib, types
+
+
+
+class LazyModule(types.ModuleType):
+	"""
+	Stand in for a module, whose lazy attributes are computed (usually
+	by importing something) when first accessed and then kept. To make
+	a module lazy, end it with
+
+		sys.modules[__name__] = LazyModule(sys.modules[__name__], {
+			name: function returning the attribute's value,
+			...
+		})
+
+	A package's lazy attribute may share its name with a submodule
+	(as a class often shares its module's name); the attribute keeps
+	its value when the submodule is imported.
+	"""
+	def __init__(self, module, lazyAttributes):
+		types.ModuleType.__init__(self, module.__name__, module.__doc__)
+		self.__dict__.update(module.__dict__)
+		self.__dict__['_LazyModule__lazyAttributes'] = lazyAttributes
+		# Python 2 clears a module's globals when the module is freed,
+		# which would break the functions defined in it.
+		self.__dict__['_LazyModule__module'] = module
+
+
+	def __getattr__(self, name):
+		"""Called only for attributes not found the usual way."""
+		try:
+			getValue = self.__lazyAttributes.pop(name)
+		except KeyError:
+			raise AttributeError("module '%s' has no attribute '%s'"
+				% (self.__name__, name))
+		value = getValue()
+		setattr(self, name, value)
+		return value
+
+
+	def __getattribute__(self, name):
+		value = types.ModuleType.__getattribute__(self, name)
+		if (isinstance(value, types.ModuleType)
+		and value.__name__ == self.__name__ + '.' + name):
+			# Importing a submodule binds it to its name in the package,
+			# without going through __setattr__ on Python 2. Put back
+			# what the name stands for, which may be a name from that
+			# submodule.
+			getValue = self.__lazyAttributes.pop(name, None)
+			if getValue is not None:
+				value = getValue()
+				self.__dict__[name] = value
+		return value
+
+
+	def __dir__(self):
+		return sorted(set(self.__dict__) | set(self.__lazyAttributes))
+
+
+
+def ImportModule(*moduleNames):
+	"""
+	Return a function which imports and returns the first of
+	moduleNames that can be imported. If the last name is None, the
+	function returns None when none can be.
+	"""
+	def importModule():
+		for moduleName in moduleNames:
+			if moduleName is None:
+				return None
+			try:
+				return importlib.import_module(moduleName)
+			except ImportError:
+				if moduleName == moduleNames[-1]:
+					raise
+	return importModule
+
+
+def ImportFrom(moduleName, attributeName):
+	"""
+	Return a function which imports moduleName and returns its
+	attribute attributeName.
+	"""
+	def importFrom():
+		return getattr(importlib.import_module(moduleName), attributeName)
+	return importFrom
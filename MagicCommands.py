@@ -0,0 +1,222 @@
+"""
+Time and profile code from the console with commands like
+
+	%timeit [-n LOOPS] [-r REPEATS] STATEMENT
+	%prun [-s SORT_KEY] [-l LIMIT] STATEMENT
+	%memory [-l LIMIT] STATEMENT
+
+which run STATEMENT in the console's namespace and return a report.
+
+Uses only the standard library, so that KernelProcess can use it too.
+"""
+
+__all__ = [
+	'MagicError',
+	'IsMagic',
+	'RunMagic',
+	'GetPeakMemoryKiB',
+]
+
+import cProfile, gc, pstats, re, sys, timeit, StringIO
+try:
+	import resource
+except ImportError:
+	# Windows.
+	resource = None
+
+MAGIC_RE = re.compile(r'^%(\w+)\s*(.*)$')
+
+TIMEIT_MIN_TIME_S = 0.2
+TIMEIT_REPEATS = 5
+PRUN_SORT_KEY = 'cumulative'
+PRUN_LIMIT = 25
+MEMORY_LIMIT = 10
+
+TIMEIT_TEMPLATE = """
+def inner(_it, _timer):
+	_t0 = _timer()
+	for _i in _it:
+		%s
+	return _timer() - _t0
+"""
+
+
+
+class MagicError(ValueError):
+	"""A magic command is malformed."""
+	pass
+
+
+
+def IsMagic(line):
+	"""Return whether line is a magic command."""
+	m = MAGIC_RE.match(line)
+	return m is not None and m.group(1) in _MAGICS
+
+
+def RunMagic(line, namespace):
+	"""
+	Run the magic command in line over namespace, and return its
+	report. Exceptions from the statement are passed on.
+	"""
+	m = MAGIC_RE.match(line)
+	if m is None or m.group(1) not in _MAGICS:
+		raise MagicError('not a magic command: %r' % line)
+	name, argument = m.group(1, 2)
+	magic, options = _MAGICS[name]
+	values, statement = _ParseOptions(name, argument, options)
+	if not statement:
+		raise MagicError('%%%s needs a statement' % name)
+	return magic(statement, namespace, **values)
+
+
+def _ParseOptions(name, argument, options):
+	"""
+	Parse leading '-x VALUE' options of argument. options maps option
+	letters to (keyword, type). Return (keyword -> value, the rest of
+	argument).
+	"""
+	values = {}
+	words = argument.split(None, 1)
+	while words and re.match(r'^-\w$', words[0]):
+		option = words[0][1]
+		if option not in options or len(words) < 2:
+			raise MagicError('bad option -%s for %%%s' % (option, name))
+		valueAndRest = words[1].split(None, 1)
+		keyword, valueType = options[option]
+		try:
+			values[keyword] = valueType(valueAndRest[0])
+		except ValueError:
+			raise MagicError('bad value %r for option -%s of %%%s'
+				% (valueAndRest[0], option, name))
+		if len(valueAndRest) > 1:
+			words = valueAndRest[1].split(None, 1)
+		else:
+			words = []
+	return values, ' '.join(words)
+
+
+def _FormatTime(seconds):
+	for unit, scale in (('s', 1.0), ('ms', 1e3), ('usec', 1e6)):
+		if seconds >= 1.0/scale:
+			return '%.3g %s' % (seconds*scale, unit)
+	return '%.3g ns' % (seconds*1e9)
+
+
+def _TimeIt(statement, namespace, number=None, repeat=TIMEIT_REPEATS):
+	"""
+	Time statement like the timeit module, but with the names of
+	namespace. Unless number is given, loop counts of 1, 10, 100, ...
+	are tried until a run takes TIMEIT_MIN_TIME_S.
+	"""
+	compile(statement, '<timeit>', 'exec')
+	functions = {}
+	exec(compile(TIMEIT_TEMPLATE % statement, '<timeit>', 'exec'),
+		namespace, functions)
+	inner = functions['inner']
+	timer = timeit.default_timer
+
+	gcWasEnabled = gc.isenabled()
+	gc.disable()
+	try:
+		if number is None:
+			number = 1
+			while True:
+				elapsed = inner(xrange(number), timer)
+				if elapsed >= TIMEIT_MIN_TIME_S:
+					break
+				number *= 10
+		times = [inner(xrange(number), timer)/number
+			for i in xrange(max(1, repeat))]
+	finally:
+		if gcWasEnabled:
+			gc.enable()
+
+	mean = sum(times)/len(times)
+	return '%d loop%s, best of %d: %s per loop (mean %s)\n' % (
+		number, number != 1 and 's' or '', len(times),
+		_FormatTime(min(times)), _FormatTime(mean))
+
+
+def _Profile(statement, namespace, sortKey=PRUN_SORT_KEY,
+limit=PRUN_LIMIT):
+	"""Run statement under cProfile and return a table of stats."""
+	codeObject = compile(statement, '<prun>', 'exec')
+	profile = cProfile.Profile()
+	profile.runctx(codeObject, namespace, namespace)
+	stream = StringIO.StringIO()
+	stats = pstats.Stats(profile, stream=stream)
+	try:
+		stats.strip_dirs().sort_stats(sortKey).print_stats(limit)
+	except KeyError:
+		raise MagicError('unknown sort key %r' % sortKey)
+	return stream.getvalue().lstrip('\n')
+
+
+def _CountObjects():
+	"""Return type -> number of objects the garbage collector tracks."""
+	counts = {}
+	for obj in gc.get_objects():
+		objType = type(obj)
+		counts[objType] = counts.get(objType, 0) + 1
+	return counts
+
+
+def GetPeakMemoryKiB():
+	"""
+	Return the process's peak resident memory in KiB, or None where
+	the platform doesn't report it.
+	"""
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		# In bytes rather than kilobytes.
+		peak /= 1024
+	return peak
+
+
+def _TypeName(objType):
+	if objType.__module__ in ('__builtin__', 'builtins'):
+		return objType.__name__
+	return '%s.%s' % (objType.__module__, objType.__name__)
+
+
+def _MemoryDiff(statement, namespace, limit=MEMORY_LIMIT):
+	"""
+	Run statement and return the types whose number of objects grew
+	the most, and how much the process's peak resident memory rose.
+	Only objects the garbage collector tracks (containers and
+	instances, but not strings or numbers) are counted.
+	"""
+	codeObject = compile(statement, '<memory>', 'exec')
+	gc.collect()
+	before = _CountObjects()
+	startPeak = GetPeakMemoryKiB()
+	exec(codeObject, namespace)
+	endPeak = GetPeakMemoryKiB()
+	gc.collect()
+	after = _CountObjects()
+	# Don't count the dict that holds the counts from before.
+	after[dict] -= 1
+
+	growth = [(after[objType] - before.get(objType, 0), objType)
+		for objType in after]
+	growth.sort(key=lambda item: -item[0])
+	lines = ['%+d %s\n' % (n, _TypeName(objType))
+		for n, objType in growth[:limit] if n > 0]
+	if not lines:
+		lines.append('no more objects are tracked than before\n')
+	if startPeak is not None:
+		lines.append('peak resident memory: +%d KiB\n'
+			% (endPeak - startPeak))
+	return ''.join(lines)
+
+
+
+_MAGICS = {
+	'timeit': (_TimeIt, {'n': ('number', int), 'r': ('repeat', int)}),
+	'prun': (_Profile, {'s': ('sortKey', str), 'l': ('limit', int)}),
+	'memory': (_MemoryDiff, {'l': ('limit', int)}),
+}
+"""name -> (function, option letter -> (keyword, type))"""
@@ -1,17 +1,46 @@
 """
 Import modules used only in the UI.
-"""
-
-from PyQt4 import QtCore, QtGui
 
-import code, traceback
-import enum
-import datetime
+Each module is imported when it is first asked for (usually by a
+"from Manifest import ..." statement), so that code which needs only
+some of them, like ResourceManager, does not pay for the rest.
+"""
 
-import logging, sys, rlcompleter, os
+import sys
+from LazyModule import LazyModule, ImportModule
 
 if not hasattr(sys, 'ps1'):
         sys.ps1 = '>>> '
 if not hasattr(sys, 'ps2'):
         sys.ps2 = '... '
 
+_MODULES = {
+	'QtCore': ImportModule('PyQt4.QtCore'),
+	'QtGui': ImportModule('PyQt4.QtGui'),
+
+	'code': ImportModule('code'),
+	'traceback': ImportModule('traceback'),
+	'enum': ImportModule('enum'),
+	'datetime': ImportModule('datetime'),
+
+	'logging': ImportModule('logging'),
+	'sys': lambda: sys,
+	'rlcompleter': ImportModule('rlcompleter'),
+	'os': ImportModule('os'),
+	'threading': ImportModule('threading'),
+	'Queue': ImportModule('Queue'),
+	'ctypes': ImportModule('ctypes'),
+	'json': ImportModule('json'),
+	'signal': ImportModule('signal'),
+	'collections': ImportModule('collections'),
+	'heapq': ImportModule('heapq'),
+	'fnmatch': ImportModule('fnmatch'),
+	're': ImportModule('re'),
+	'keyword': ImportModule('keyword'),
+	'time': ImportModule('time'),
+	'__builtin__': ImportModule('__builtin__'),
+	# repr is the Python 2 name.
+	'reprlib': ImportModule('reprlib', 'repr'),
+}
+
+sys.modules[__name__] = LazyModule(sys.modules[__name__], _MODULES)
@@ -0,0 +1,137 @@
+"""
+Highlight Python source in a QTextDocument as it is edited.
+"""
+
+__all__ = [
+	'PythonHighlighter',
+]
+
+from Manifest import QtCore, QtGui, re, keyword, __builtin__
+import Drawing
+
+_TRIPLE_QUOTES = ["'''", '"""']
+
+_STRING_END_RES = [re.compile(r'(?:\\.|[^\\])*?' + quotes)
+	for quotes in _TRIPLE_QUOTES]
+"""for each kind of triple quote, matches up to the end of the string"""
+
+_TOKEN_RE = re.compile(r'''
+	(?P<comment>\#.*)
+	| (?P<tripleQuote>[rRuUbB]{0,2}(?:\'\'\'|"""))
+	| (?P<string>[rRuUbB]{0,2}(?:
+		'(?:\\.|[^'\\])*'? | "(?:\\.|[^"\\])*"?))
+	| (?P<decorator>@[\w.]+)
+	| (?P<number>\b(?:0[xX][0-9a-fA-F]+|\d+\.?\d*(?:[eE][+-]?\d+)?)
+		[lLjJ]?\b)
+	| (?P<identifier>[A-Za-z_]\w*)
+	''', re.VERBOSE)
+
+_KEYWORDS = frozenset(keyword.kwlist)
+_BUILTINS = frozenset([name for name in dir(__builtin__)
+	if not name.startswith('_')])
+
+
+
+def _MakeFormats(palette):
+	textColor = palette.color(QtGui.QPalette.Text)
+	darkBackground = palette.color(QtGui.QPalette.Base).valueF() < 0.5
+	value = darkBackground and 0.9 or 0.55
+
+	def makeFormat(hue=None, color=None, bold=False, italic=False):
+		format = QtGui.QTextCharFormat()
+		if hue is not None:
+			color = QtGui.QColor.fromHsvF(hue, 0.8, value)
+		format.setForeground(QtGui.QBrush(color or textColor))
+		if bold:
+			format.setFontWeight(QtGui.QFont.Bold)
+		format.setFontItalic(italic)
+		return format
+
+	return {
+		'keyword': makeFormat(hue=0.62, bold=True),
+		'builtin': makeFormat(hue=0.75),
+		'string': makeFormat(hue=0.33),
+		'number': makeFormat(hue=0.08),
+		'decorator': makeFormat(hue=0.85),
+		'comment': makeFormat(color=palette.color(QtGui.QPalette.Disabled,
+			QtGui.QPalette.Text), italic=True),
+	}
+
+
+
+class PythonHighlighter(QtGui.QSyntaxHighlighter):
+	"""
+	Highlight keywords, builtins, strings, numbers, decorators and
+	comments.
+
+	Each block's state holds only whether it ends inside a
+	triple-quoted string, and which kind. Editing a block re-highlights
+	only that block, unless its end state changes (as when a triple
+	quote is typed), in which case QSyntaxHighlighter goes on to the
+	following blocks until their states stop changing.
+	"""
+	def __init__(self, document, palette=None):
+		QtGui.QSyntaxHighlighter.__init__(self, document)
+		self.__formats = Drawing.GetPaletteValue(
+			'PythonHighlighter.formats', _MakeFormats, palette)
+
+
+	def setPalette(self, palette=None):
+		"""Take colors from palette (by default the application's)."""
+		self.__formats = Drawing.GetPaletteValue(
+			'PythonHighlighter.formats', _MakeFormats, palette)
+		self.rehighlight()
+
+
+	def highlightBlock(self, qText):
+		text = unicode(qText)
+		stringState = max(0, self.previousBlockState())
+		formats = self.__formats
+
+		pos = 0
+		if stringState:
+			pos = self.__continueString(text, 0, stringState)
+			if pos is None:
+				self.setCurrentBlockState(stringState)
+				return
+			stringState = 0
+
+		while True:
+			m = _TOKEN_RE.search(text, pos)
+			if m is None:
+				break
+			kind = m.lastgroup
+			start, pos = m.span()
+			if kind == 'identifier':
+				word = m.group()
+				if word in _KEYWORDS:
+					self.setFormat(start, pos - start, formats['keyword'])
+				elif word in _BUILTINS:
+					self.setFormat(start, pos - start, formats['builtin'])
+			elif kind == 'tripleQuote':
+				stringState = _TRIPLE_QUOTES.index(m.group()[-3:]) + 1
+				end = self.__continueString(text, pos, stringState)
+				self.setFormat(start, (end or len(text)) - start,
+					formats['string'])
+				if end is None:
+					break
+				pos = end
+				stringState = 0
+			else:
+				self.setFormat(start, pos - start, formats[kind])
+
+		self.setCurrentBlockState(stringState)
+
+
+	def __continueString(self, text, pos, stringState):
+		"""
+		Highlight the part of a triple-quoted string (of the kind
+		stringState) in text from pos. Return where the string ends,
+		or None if it goes on to the next block.
+		"""
+		m = _STRING_END_RES[stringState - 1].match(text, pos)
+		if m is None:
+			self.setFormat(pos, len(text) - pos, self.__formats['string'])
+			return None
+		self.setFormat(pos, m.end() - pos, self.__formats['string'])
+		return m.end()
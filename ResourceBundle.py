@@ -0,0 +1,125 @@
+"""
+Pack a directory of resource files into one bundle file, and read
+files back out of a bundle through a memory map.
+
+A bundle is a header, a JSON index of local filename ('/'-separated)
+-> [offset, size], then the files' contents concatenated; offsets are
+from the start of the contents. To make a bundle:
+
+	python ResourceBundle.py SOURCE_DIR BUNDLE_FILE
+
+This module uses only the standard library, so that it runs as a tool
+without Qt.
+"""
+
+__all__ = [
+	'PackBundle',
+	'IsBundle',
+	'ResourceBundle',
+]
+
+import json, mmap, os, struct, sys
+
+MAGIC = 'QtURBndl'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+"""magic, version, index length in bytes"""
+
+
+
+def PackBundle(sourceDir, bundlePath):
+	"""
+	Write every file under sourceDir into a new bundle at bundlePath.
+	Return the number of files packed.
+	"""
+	index = {}
+	contents = []
+	offset = 0
+	for dirPath, dirNames, fileNames in os.walk(sourceDir,
+	followlinks=True):
+		dirNames.sort()
+		relDir = os.path.relpath(dirPath, sourceDir)
+		for fileName in sorted(fileNames):
+			localFilename = os.path.normpath(
+				os.path.join(relDir, fileName))
+			with open(os.path.join(dirPath, fileName), 'rb') as f:
+				data = f.read()
+			index[localFilename.replace(os.sep, '/')] = \
+				[offset, len(data)]
+			contents.append(data)
+			offset += len(data)
+
+	indexData = json.dumps(index, sort_keys=True)
+	with open(bundlePath, 'wb') as f:
+		f.write(HEADER.pack(MAGIC, VERSION, len(indexData)))
+		f.write(indexData)
+		for data in contents:
+			f.write(data)
+	return len(index)
+
+
+def IsBundle(path):
+	try:
+		with open(path, 'rb') as f:
+			header = f.read(HEADER.size)
+	except IOError:
+		return False
+	return len(header) == HEADER.size \
+		and HEADER.unpack(header)[0] == MAGIC
+
+
+
+class ResourceBundle(object):
+	"""
+	Read-only access to the files in a bundle. The bundle is opened
+	once and memory-mapped, so only the pages of files which are
+	actually read are loaded.
+	"""
+	def __init__(self, path):
+		self.__path = os.path.abspath(path)
+		with open(self.__path, 'rb') as f:
+			self.__map = mmap.mmap(f.fileno(), 0,
+				access=mmap.ACCESS_READ)
+		magic, version, indexLength = HEADER.unpack(
+			self.__map[:HEADER.size])
+		if magic != MAGIC or version != VERSION:
+			self.__map.close()
+			raise ValueError("'%s' is not a version %d resource bundle"
+				% (self.__path, VERSION))
+		indexEnd = HEADER.size + indexLength
+		self.__index = json.loads(self.__map[HEADER.size:indexEnd])
+		self.__dataStart = indexEnd
+
+
+	def path(self):
+		return self.__path
+
+
+	def names(self):
+		"""Return the '/'-separated local filenames in the bundle."""
+		return self.__index.keys()
+
+
+	def __contains__(self, localFilename):
+		return localFilename in self.__index
+
+
+	def read(self, localFilename):
+		"""Return the contents of a file in the bundle."""
+		offset, size = self.__index[localFilename]
+		start = self.__dataStart + offset
+		return self.__map[start:start + size]
+
+
+	def close(self):
+		self.__map.close()
+
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		sys.stderr.write('usage: %s SOURCE_DIR BUNDLE_FILE\n'
+			% sys.argv[0])
+		sys.exit(2)
+	n = PackBundle(sys.argv[1], sys.argv[2])
+	sys.stdout.write('packed %d files into %s\n' % (n, sys.argv[2]))
@@ -5,39 +5,339 @@ Manage retrieval of support files for the UI.
 __all__ = [
 	'AppendResourcePath',
 	'GetFile',
+	'GetData',
+	'RefreshResourceIndex',
+	'SetResourceWatching',
 	'GetIcon',
+	'PreloadIcons',
+
+	'SetImageCacheBudget',
+	'GetImageCacheStats',
+	'InvalidateImageCache',
 ]
 
-from Manifest import QtCore, QtGui, os, logging
+from Manifest import QtCore, QtGui, os, logging, collections, \
+	threading, fnmatch, re
+import ResourceBundle
 log = logging.getLogger('ResourceManager')
 
 ICON_SUBDIR = 'icons'
+ICON_VARIANT_RE = re.compile(r'^(.*)@\d+x?(\.\w+)?$')
+"""
+matches size variants of icon files, like name@16.png (16 pixels) or
+name@2x.png, capturing the name and extension of the base file
+"""
 
 global resourcePaths
 resourcePaths = []
-"""list of directories in which to search for resource files"""
+"""
+list of directories and bundle files in which to search for resource
+files
+"""
+
+global resourceBundles
+resourceBundles = {}
+"""bundle file path -> ResourceBundle, for bundles in resourcePaths"""
+
+global bundleMembers
+bundleMembers = {}
+"""
+path of a file in a bundle (as if the bundle were a directory) ->
+(ResourceBundle, name in the bundle); these paths are only used as
+keys, and appear as values in resourceIndex
+"""
+
+global resourceIndex
+resourceIndex = None
+"""
+normalized local filename -> absolute path, for every file under the
+resource paths (the first path having a file wins); built on first use
+"""
+
+global iconVariants
+iconVariants = None
+"""
+normalized local filename -> list of paths of its size variants, built
+from resourceIndex on first use
+"""
+
+global resourceWatcher
+resourceWatcher = None
+"""QFileSystemWatcher which refreshes resourceIndex, if enabled"""
+
+global activePreloaders
+activePreloaders = set()
+"""
+IconPreloaders which haven't finished; kept here so that they outlive
+their decoding threads even if the caller drops them
+"""
+
+
+
+class ImageCache(object):
+	"""
+	Least-recently-used cache of absolute path -> (QPixmap, QIcon),
+	holding at most about budgetBytes of pixmap data. GetIcon also keeps
+	its icons here, under ('icon', local filename) -> (None, QIcon), and
+	scaled pixmaps, under (path, width, height, mode) -> (QPixmap, None).
+
+	Paths (or local filenames) known not to give an image are remembered
+	separately, so they are neither retried nor counted in the budget.
+	"""
+	DEFAULT_BUDGET_BYTES = 32*1024*1024
+
+	def __init__(self, budgetBytes=DEFAULT_BUDGET_BYTES):
+		self.__budgetBytes = budgetBytes
+		self.__entries = collections.OrderedDict()
+		"""key -> (image data, estimated bytes), oldest use first"""
+		self.__nBytes = 0
+		self.__missing = set()
+		self.__hits = 0
+		self.__misses = 0
+		self.__evictions = 0
+
+
+	def __contains__(self, key):
+		return key in self.__entries
+
+
+	def get(self, key):
+		entry = self.__entries.pop(key, None)
+		if entry is None:
+			self.__misses += 1
+			return None
+		self.__hits += 1
+		self.__entries[key] = entry
+		return entry[0]
+
+
+	def put(self, key, imageData, nBytes):
+		old = self.__entries.pop(key, None)
+		if old is not None:
+			self.__nBytes -= old[1]
+		self.__entries[key] = (imageData, nBytes)
+		self.__nBytes += nBytes
+		self.__evict()
+
+
+	def isMissing(self, key):
+		return key in self.__missing
+
+
+	def addMissing(self, key):
+		self.__missing.add(key)
+
+
+	def forgetMissing(self):
+		self.__missing.clear()
+
+
+	def invalidate(self, key=None):
+		"""Forget key, or everything if key is None."""
+		if key is None:
+			self.__entries.clear()
+			self.__nBytes = 0
+			self.__missing.clear()
+		else:
+			entry = self.__entries.pop(key, None)
+			if entry is not None:
+				self.__nBytes -= entry[1]
+			self.__missing.discard(key)
+
+
+	def setBudget(self, budgetBytes):
+		self.__budgetBytes = budgetBytes
+		self.__evict()
+
+
+	def stats(self):
+		return {
+			'hits': self.__hits,
+			'misses': self.__misses,
+			'evictions': self.__evictions,
+			'entries': len(self.__entries),
+			'missing': len(self.__missing),
+			'bytes': self.__nBytes,
+			'budgetBytes': self.__budgetBytes,
+		}
+
+
+	def __evict(self):
+		# Always keep the newest entry, even if it alone is over budget.
+		while self.__nBytes > self.__budgetBytes \
+		and len(self.__entries) > 1:
+			key, (imageData, nBytes) = self.__entries.popitem(last=False)
+			self.__nBytes -= nBytes
+			self.__evictions += 1
+
 
 global imageCache
-imageCache = {}
-"""absolute path -> (QPixmap, QIcon)"""
+imageCache = ImageCache()
+
+global nullImage
+nullImage = None
+"""(QPixmap, QIcon) given for missing images, created on first use"""
 
 
 def AppendResourcePath(newPath):
+	"""
+	Search newPath, a directory or a bundle made by ResourceBundle,
+	for resource files after the paths already added.
+	"""
 	path = os.path.abspath(newPath)
-	if os.path.isdir(path):
-		global resourcePaths
+	isDir = os.path.isdir(path)
+	if isDir or ResourceBundle.IsBundle(path):
+		global resourcePaths, resourceBundles
 		if path not in resourcePaths:
+			if not isDir:
+				resourceBundles[path] = \
+					ResourceBundle.ResourceBundle(path)
 			resourcePaths.append(path)
 			log.debug("adding resource path '%s'" % path)
+			global resourceIndex, iconVariants
+			if resourceIndex is not None:
+				_IndexResourcePath(resourceIndex, path)
+			iconVariants = None
+			global imageCache
+			imageCache.forgetMissing()
+	else:
+		log.warning("ignoring resource path '%s':"
+			" not a directory or resource bundle" % path)
+
+
+def _NormalizeLocalFilename(localFilename):
+	return os.path.normcase(os.path.normpath(localFilename))
+
+
+def _IndexResourcePath(index, resourcePath):
+	global resourceBundles
+	bundle = resourceBundles.get(resourcePath)
+	if bundle is None:
+		_IndexResourceDir(index, resourcePath)
 	else:
-		log.warning(
-			"ignoring resource path '%s': not a directory" % path)
+		_IndexResourceBundle(index, bundle)
+
+
+def _IndexResourceBundle(index, bundle):
+	"""
+	Add the files in bundle to index, without replacing existing
+	entries.
+	"""
+	global bundleMembers
+	for name in bundle.names():
+		localFilename = _NormalizeLocalFilename(
+			name.replace('/', os.sep))
+		if localFilename not in index:
+			memberPath = os.path.join(bundle.path(), localFilename)
+			bundleMembers[memberPath] = (bundle, name)
+			index[localFilename] = memberPath
+
+
+def _IndexResourceDir(index, resourceDir):
+	"""
+	Add the files under resourceDir to index, without replacing
+	existing entries.
+	"""
+	global resourceWatcher
+	for dirPath, dirNames, fileNames in os.walk(resourceDir,
+	followlinks=True):
+		if resourceWatcher is not None:
+			resourceWatcher.addPath(dirPath)
+		relDir = os.path.relpath(dirPath, resourceDir)
+		for fileName in fileNames:
+			localFilename = _NormalizeLocalFilename(
+				os.path.join(relDir, fileName))
+			if localFilename not in index:
+				index[localFilename] = os.path.join(dirPath, fileName)
+
+
+def _GetResourceIndex():
+	global resourceIndex, resourcePaths, bundleMembers
+	if resourceIndex is None:
+		index = {}
+		bundleMembers.clear()
+		for resourcePath in resourcePaths:
+			_IndexResourcePath(index, resourcePath)
+		resourceIndex = index
+		log.debug('indexed %d resource files' % len(index))
+	return resourceIndex
+
+
+def RefreshResourceIndex():
+	"""
+	Notice files added to or removed from the resource paths. The index
+	is rebuilt on the next lookup.
+	"""
+	global resourceIndex, iconVariants, imageCache
+	resourceIndex = None
+	iconVariants = None
+	imageCache.forgetMissing()
+
+
+def SetResourceWatching(enabled):
+	"""
+	Watch the resource directories, and refresh the index whenever they
+	change, so that RefreshResourceIndex need not be called.
+	"""
+	global resourceWatcher
+	if enabled and resourceWatcher is None:
+		resourceWatcher = QtCore.QFileSystemWatcher()
+		QtCore.QObject.connect(resourceWatcher,
+			QtCore.SIGNAL('directoryChanged(const QString &)'),
+			_ResourceDirChanged)
+		RefreshResourceIndex()
+	elif not enabled and resourceWatcher is not None:
+		resourceWatcher.deleteLater()
+		resourceWatcher = None
+
+
+def _ResourceDirChanged(path):
+	global resourceWatcher
+	if resourceWatcher is not None:
+		directories = resourceWatcher.directories()
+		if not directories.isEmpty():
+			resourceWatcher.removePaths(directories)
+	RefreshResourceIndex()
 
 
 def GetFile(localFilename):
 	"""
 	Return an absolute path for the given (probably) local filename,
-	or None of no existing file can be found.
+	or None of no existing file can be found. Files inside resource
+	bundles are not files on disk, so are not found; use GetData.
+
+	Local filenames are looked up in an index of the resource paths'
+	contents, so files added after the index was built are not found
+	until RefreshResourceIndex is called (or SetResourceWatching is on).
+	"""
+	global bundleMembers
+	path = _FindResource(localFilename)
+	if path in bundleMembers:
+		return None
+	return path
+
+
+def GetData(localFilename):
+	"""
+	Return the contents of a resource file, which may be in a bundle,
+	or None if it can't be found.
+	"""
+	global bundleMembers
+	path = _FindResource(localFilename)
+	if path is None:
+		return None
+	member = bundleMembers.get(path)
+	if member is not None:
+		bundle, name = member
+		return bundle.read(name)
+	with open(path, 'rb') as f:
+		return f.read()
+
+
+def _FindResource(localFilename):
+	"""
+	Like GetFile, but also return paths of files in bundles (keys of
+	bundleMembers).
 	"""
 	if os.path.isabs(localFilename):
 		absFilename = localFilename
@@ -45,35 +345,367 @@ def GetFile(localFilename):
 			return absFilename
 		else:
 			return None
-	else:
-		global resourcePaths
+
+	localFilename = _NormalizeLocalFilename(localFilename)
+	if localFilename.startswith(os.pardir):
+		# Outside of the resource paths, so not indexed.
+		global resourcePaths, resourceBundles
 		for resourceDir in resourcePaths:
+			if resourceDir in resourceBundles:
+				continue
 			absFilename = os.path.join(resourceDir, localFilename)
 			if os.path.isfile(absFilename):
 				return absFilename
 		return None
+	return _GetResourceIndex().get(localFilename)
+
+
+def _GetNullImage():
+	global nullImage
+	if nullImage is None:
+		pixmap = QtGui.QPixmap()
+		nullImage = (pixmap, QtGui.QIcon(pixmap))
+	return nullImage
+
+
+def _EstimateBytes(pixmap):
+	return pixmap.width()*pixmap.height()*pixmap.depth()/8
 
 
 def _GetImage(path):
 	global imageCache
+	if not path or imageCache.isMissing(path):
+		return _GetNullImage()
+
 	imageData = imageCache.get(path)
 	if not imageData:
-		if path:
-			pixmap = QtGui.QPixmap(path)
-		else:
-			pixmap = QtGui.QPixmap()
-		icon = QtGui.QIcon(pixmap)
-		imageData = (pixmap, icon)
-		imageCache[path] = imageData
+		imageData = _CacheImage(path, _ReadImage(QtGui.QPixmap, path))
+	return imageData
 
-		if pixmap.isNull():
-			log.warning("null QPixmap from '%s'" % path)
+
+def _ReadImage(imageClass, path):
+	"""
+	Load a QPixmap or QImage (imageClass) from a file or bundle member.
+	"""
+	global bundleMembers
+	member = bundleMembers.get(path)
+	if member is None:
+		return imageClass(path)
+	bundle, name = member
+	image = imageClass()
+	image.loadFromData(bundle.read(name))
+	return image
+
+
+def _CacheImage(path, pixmap):
+	"""Cache and return image data for pixmap, loaded from path."""
+	global imageCache
+	if pixmap.isNull():
+		log.warning("null QPixmap from '%s'" % path)
+		imageCache.addMissing(path)
+		return _GetNullImage()
+	imageData = (pixmap, QtGui.QIcon(pixmap))
+	imageCache.put(path, imageData, _EstimateBytes(pixmap))
 	return imageData
 
 
+def _GetIconVariants(localFilename):
+	"""Return the paths of size variants of localFilename."""
+	global iconVariants
+	if iconVariants is None:
+		variants = {}
+		for variantFilename, path in _GetResourceIndex().iteritems():
+			m = ICON_VARIANT_RE.match(variantFilename)
+			if m:
+				baseFilename = m.group(1) + (m.group(2) or '')
+				variants.setdefault(baseFilename, []).append(path)
+		iconVariants = variants
+	return iconVariants.get(_NormalizeLocalFilename(localFilename), [])
+
+
 def GetIcon(filename):
-	path = GetFile(os.path.join(ICON_SUBDIR, filename))
-	pixmap, icon = _GetImage(path)
+	"""
+	Return a QIcon for filename in the icons subdirectory of the
+	resource paths. Size variants of the file (for name.png, files like
+	name@16.png or name@2x.png) are used too: each size is drawn from
+	the smallest image at least that big, scaled down if need be.
+	Scaled pixmaps are kept in the image cache. An icon with no size
+	variants is a plain QIcon of its one image.
+	"""
+	global imageCache
+	localFilename = _NormalizeLocalFilename(
+		os.path.join(ICON_SUBDIR, filename))
+	if imageCache.isMissing(localFilename):
+		return _GetNullImage()[1]
+
+	paths = _GetIconVariants(localFilename)
+	path = _FindResource(localFilename)
+	if not paths:
+		if path is None:
+			log.warning("no icon file '%s'" % localFilename)
+			imageCache.addMissing(localFilename)
+		return _GetImage(path)[1]
+
+	iconKey = ('icon', localFilename)
+	imageData = imageCache.get(iconKey)
+	if imageData:
+		return imageData[1]
+	if path is not None:
+		paths = [path] + paths
+
+	icon = QtGui.QIcon(_ScaledIconEngine(paths))
+	imageCache.put(iconKey, (None, icon), 0)
 	return icon
 
 
+
+class _ScaledIconEngine(QtGui.QIconEngineV2):
+	"""
+	Draw an icon from the best of several images, getting them and
+	pixmaps scaled from them from the image cache.
+	"""
+	def __init__(self, paths):
+		QtGui.QIconEngineV2.__init__(self)
+		self.__paths = paths
+
+
+	def __getSource(self, size):
+		"""
+		Return (path, QPixmap) for the smallest image at least as big
+		as size, or else the biggest image.
+		"""
+		best = (None, None)
+		bestFits = False
+		for path in self.__paths:
+			pixmap = _GetImage(path)[0]
+			if pixmap.isNull():
+				continue
+			fits = pixmap.width() >= size.width() \
+				and pixmap.height() >= size.height()
+			if best[1] is None \
+			or (fits and (not bestFits
+				or pixmap.width() < best[1].width())) \
+			or (not fits and not bestFits
+				and pixmap.width() > best[1].width()):
+				best = (path, pixmap)
+				bestFits = fits
+		return best
+
+
+	def __getActualSize(self, source, size):
+		"""Like QIcon, scale down to fit size but never up."""
+		actualSize = source.size()
+		if actualSize.width() > size.width() \
+		or actualSize.height() > size.height():
+			actualSize.scale(size, QtCore.Qt.KeepAspectRatio)
+		return actualSize
+
+
+	def actualSize(self, size, mode, state):
+		path, source = self.__getSource(size)
+		if source is None:
+			return QtCore.QSize()
+		return self.__getActualSize(source, size)
+
+
+	def pixmap(self, size, mode, state):
+		global imageCache
+		path, source = self.__getSource(size)
+		if source is None:
+			return QtGui.QPixmap()
+		actualSize = self.__getActualSize(source, size)
+		if actualSize == source.size() and mode == QtGui.QIcon.Normal:
+			return source
+
+		key = (path, actualSize.width(), actualSize.height(), int(mode))
+		imageData = imageCache.get(key)
+		if imageData:
+			return imageData[0]
+
+		pixmap = source
+		if actualSize != source.size():
+			pixmap = source.scaled(actualSize,
+				QtCore.Qt.IgnoreAspectRatio,
+				QtCore.Qt.SmoothTransformation)
+		if mode != QtGui.QIcon.Normal:
+			option = QtGui.QStyleOption()
+			option.palette = QtGui.QApplication.palette()
+			generated = QtGui.QApplication.style().generatedIconPixmap(
+				mode, pixmap, option)
+			if not generated.isNull():
+				pixmap = generated
+		imageCache.put(key, (pixmap, None), _EstimateBytes(pixmap))
+		return pixmap
+
+
+	def paint(self, painter, rect, mode, state):
+		pixmap = self.pixmap(rect.size(), mode, state)
+		if pixmap.isNull():
+			return
+		x = rect.x() + (rect.width() - pixmap.width())/2
+		y = rect.y() + (rect.height() - pixmap.height())/2
+		painter.drawPixmap(x, y, pixmap)
+
+
+	def clone(self):
+		return _ScaledIconEngine(self.__paths)
+
+
+def PreloadIcons(filenames):
+	"""
+	Start loading icons into the cache, so that later calls to GetIcon
+	don't have to. filenames is either a list of names as given to
+	GetIcon, or one glob pattern (like '*.png') matched against all
+	icon files.
+
+	Images are decoded on QThreadPool's threads, and added to the cache
+	on the GUI thread in batches. Return the IconPreloader doing this.
+	"""
+	global imageCache
+	iconDir = _NormalizeLocalFilename(ICON_SUBDIR) + os.sep
+	if isinstance(filenames, basestring):
+		pattern = iconDir + _NormalizeLocalFilename(filenames)
+		index = _GetResourceIndex()
+		paths = [index[localFilename] for localFilename
+			in fnmatch.filter(index.keys(), pattern)]
+	else:
+		paths = []
+		for filename in filenames:
+			localFilename = os.path.join(ICON_SUBDIR, filename)
+			path = _FindResource(localFilename)
+			variantPaths = _GetIconVariants(localFilename)
+			if path is None and not variantPaths:
+				log.warning("no icon file '%s'" % localFilename)
+				imageCache.addMissing(
+					_NormalizeLocalFilename(localFilename))
+			elif path is not None:
+				paths.append(path)
+			paths.extend(variantPaths)
+	return IconPreloader([path for path in paths
+		if path not in imageCache and not imageCache.isMissing(path)])
+
+
+
+class IconPreloader(QtCore.QObject):
+	"""
+	Decode image files on QThreadPool's threads, and put the resulting
+	pixmaps in the image cache on the GUI thread, in batches.
+
+	Signals:
+		progress	number of images cached so far, total number
+		finished	(no arguments) all images are cached
+	"""
+	BATCH_INTERVAL_MS = 20
+
+	def __init__(self, paths, parent=None):
+		global activePreloaders
+		QtCore.QObject.__init__(self, parent)
+		self.__total = len(paths)
+		self.__nDone = 0
+		self.__lock = threading.Lock()
+		self.__decoded = []
+		"""(path, QImage) decoded but not cached yet"""
+		self.__nDecoded = 0
+		self.__allDecoded = threading.Event()
+
+		self.__timer = QtCore.QTimer(self)
+		self.__timer.setSingleShot(True)
+		self.__timer.setInterval(self.BATCH_INTERVAL_MS)
+		QtCore.QObject.connect(self.__timer,
+			QtCore.SIGNAL('timeout()'), self.__cacheDecoded)
+		QtCore.QObject.connect(self, QtCore.SIGNAL('decoded'),
+			self.__timer.start, QtCore.Qt.QueuedConnection)
+
+		activePreloaders.add(self)
+		if not paths:
+			self.__allDecoded.set()
+			QtCore.QTimer.singleShot(0, self.__cacheDecoded)
+		pool = QtCore.QThreadPool.globalInstance()
+		for path in paths:
+			pool.start(_ImageDecoder(path, self))
+
+
+	def isFinished(self):
+		return self.__nDone == self.__total
+
+
+	def total(self):
+		return self.__total
+
+
+	def waitForFinished(self):
+		"""Block until all the images are cached."""
+		self.__allDecoded.wait()
+		self.__cacheDecoded()
+
+
+	def imageDecoded(self, path, image):
+		"""Called from the decoding threads."""
+		with self.__lock:
+			wasEmpty = not self.__decoded
+			self.__decoded.append((path, image))
+			self.__nDecoded += 1
+			if self.__nDecoded == self.__total:
+				self.__allDecoded.set()
+		if wasEmpty:
+			self.emit(QtCore.SIGNAL('decoded'))
+
+
+	def __cacheDecoded(self):
+		global activePreloaders
+		with self.__lock:
+			decoded = self.__decoded
+			self.__decoded = []
+		if not decoded and self.__nDone:
+			return
+		for path, image in decoded:
+			_CacheImage(path, QtGui.QPixmap.fromImage(image))
+		self.__nDone += len(decoded)
+
+		self.emit(QtCore.SIGNAL('progress'), self.__nDone, self.__total)
+		if self.isFinished():
+			activePreloaders.discard(self)
+			self.emit(QtCore.SIGNAL('finished'))
+
+
+
+class _ImageDecoder(QtCore.QRunnable):
+	def __init__(self, path, preloader):
+		QtCore.QRunnable.__init__(self)
+		self.__path = path
+		self.__preloader = preloader
+
+
+	def run(self):
+		self.__preloader.imageDecoded(self.__path,
+			_ReadImage(QtGui.QImage, self.__path))
+
+
+
+def SetImageCacheBudget(budgetBytes):
+	"""
+	Limit cached pixmaps to about budgetBytes, evicting the least
+	recently used as needed.
+	"""
+	global imageCache
+	imageCache.setBudget(budgetBytes)
+
+
+def GetImageCacheStats():
+	"""
+	Return a dict of image cache hits, misses, evictions, entries,
+	missing (remembered missing images), bytes and budgetBytes.
+	"""
+	global imageCache
+	return imageCache.stats()
+
+
+def InvalidateImageCache(path=None):
+	"""
+	Forget the cached image for path (an absolute path, or a local
+	filename which was missing), or all cached images if path is None.
+	"""
+	global imageCache
+	imageCache.invalidate(path)
+
+
@@ -9,9 +9,13 @@ __all__ = [
 
 	'WriteWidgetGeometry',
 	'ReadWidgetGeometry',
+
+	'SettingsSession',
+	'SettingsSnapshot',
+	'ReadSnapshot',
 ]
 
-from Manifest import QtGui, QtCore, logging
+from Manifest import QtGui, QtCore, logging, threading
 
 log = logging.getLogger('Settings')
 
@@ -57,13 +61,286 @@ def WriteWidgetGeometry(settings, name, widget):
 
 
 def ReadWidgetGeometry(settings, name, widget):
-	with GroupGuard(settings, name):
-		pos = settings.value(WIDGET_POS_NAME).toPoint()
-		if not pos.isNull():
-			widget.move(pos)
-		size = settings.value(WIDGET_SIZE_NAME).toSize()
-		if size.isValid() and not (size.isNull() or size.isEmpty()):
-			widget.resize(size)
+	snapshot = ReadSnapshot(settings, name)
+	pos = snapshot.value(WIDGET_POS_NAME).toPoint()
+	if not pos.isNull():
+		widget.move(pos)
+	size = snapshot.value(WIDGET_SIZE_NAME).toSize()
+	if size.isValid() and not (size.isNull() or size.isEmpty()):
+		widget.resize(size)
+
+
+
+class _KeyPrefix(object):
+	"""
+	Track the key prefix set by beginGroup, beginReadArray,
+	beginWriteArray and setArrayIndex, naming keys as QSettings does:
+	the elements of array 'name' are under 'name/1', 'name/2', ..., and
+	their count is 'name/size'.
+	"""
+	def __init__(self):
+		self.__groups = []
+		"""
+		list of [name, array index or None, size to write at endArray
+		(write arrays only) or None]
+		"""
+
+
+	def beginGroup(self, name):
+		self.__groups.append([str(name), None, None])
+
+
+	def endGroup(self):
+		self.__groups.pop()
+
+
+	def group(self):
+		return self._key('')
+
+
+	def beginReadArray(self, name):
+		self.__groups.append([str(name), None, None])
+		return self.value('size').toInt()[0]
+
+
+	def beginWriteArray(self, name, size=-1):
+		self.__groups.append([str(name), None, max(size, 0)])
+
+
+	def setArrayIndex(self, i):
+		group = self.__groups[-1]
+		group[1] = i
+		if group[2] is not None:
+			group[2] = max(group[2], i + 1)
+
+
+	def endArray(self):
+		name, index, size = self.__groups.pop()
+		if size is not None:
+			self.setValue(name + '/size', QtCore.QVariant(size))
+
+
+	def _key(self, name):
+		"""Return the full key for name in the current group."""
+		parts = []
+		for groupName, index, size in self.__groups:
+			parts.append(groupName)
+			if index is not None:
+				parts.append(str(index + 1))
+		if name:
+			parts.append(str(name))
+		return '/'.join(parts)
+
+
+
+def _SameValue(a, b):
+	if a.type() == b.type():
+		return a == b
+	# QSettings reads numbers and booleans back from INI files as
+	# strings.
+	return (a.canConvert(QtCore.QVariant.String)
+		and b.canConvert(QtCore.QVariant.String)
+		and a.toString() == b.toString())
+
+
+def _WriteChanges(settings, writes, removes):
+	for key in removes:
+		settings.remove(key)
+	for key, value in writes.iteritems():
+		settings.setValue(key, value)
+	settings.sync()
+
+
+
+class SettingsSession(_KeyPrefix):
+	"""
+	Buffer writes to a QSettings and commit them all at once.
+
+	A session can be passed wherever a QSettings is used to read and
+	write settings, including to GroupGuard, ArrayReadGuard,
+	ArrayWriteGuard and the geometry functions. Writes are kept in
+	memory until commit(), which writes only the keys whose values
+	differ from those last committed (or read when the session was
+	made) and then syncs once:
+
+		session = SettingsSession(settings)
+		widget.writeSettings(session)
+		session.commit()
+
+	commit(background=True) does the writing and syncing on another
+	thread, through a separate QSettings on the same file; call wait()
+	before using the original QSettings again.
+	"""
+	def __init__(self, settings):
+		_KeyPrefix.__init__(self)
+		self.__settings = settings
+		self.__snapshot = {}
+		"""key -> QVariant, as last committed"""
+		for key in settings.allKeys():
+			key = str(key)
+			self.__snapshot[key] = settings.value(key)
+		self.__pending = {}
+		"""key -> QVariant, or None if removed"""
+		self.__commitThread = None
+
+
+	def setValue(self, key, value):
+		self.__pending[self._key(key)] = QtCore.QVariant(value)
+
+
+	def value(self, key, defaultValue=QtCore.QVariant()):
+		key = self._key(key)
+		if key in self.__pending:
+			value = self.__pending[key]
+		else:
+			value = self.__snapshot.get(key)
+		if value is None:
+			return QtCore.QVariant(defaultValue)
+		return QtCore.QVariant(value)
+
+
+	def contains(self, key):
+		key = self._key(key)
+		value = self.__pending.get(key, self.__snapshot.get(key))
+		return value is not None
+
+
+	def allKeys(self):
+		"""Return the keys under the current group, like QSettings."""
+		prefix = self._key('')
+		prefix = prefix and prefix + '/'
+		keys = set(self.__snapshot)
+		keys.update(self.__pending)
+		return sorted([key[len(prefix):] for key in keys
+			if key.startswith(prefix)
+			and self.__pending.get(key, self.__snapshot.get(key))
+				is not None])
+
+
+	def remove(self, key):
+		"""Remove key and any keys under it."""
+		key = self._key(key)
+		prefix = key and key + '/'
+		for keys in (self.__snapshot, self.__pending):
+			for k in keys:
+				if k == key or k.startswith(prefix):
+					self.__pending[k] = None
+
+
+	def changes(self):
+		"""
+		Return (key -> QVariant to write, keys to remove) for the
+		pending writes which change anything.
+		"""
+		writes = {}
+		removes = []
+		for key, value in self.__pending.iteritems():
+			old = self.__snapshot.get(key)
+			if value is None:
+				if old is not None:
+					removes.append(key)
+			elif old is None or not _SameValue(old, value):
+				writes[key] = value
+		return writes, removes
+
+
+	def commit(self, background=False):
+		"""
+		Write the changed keys and sync. Return the number of keys
+		written or removed.
+		"""
+		self.wait()
+		writes, removes = self.changes()
+		for key in removes:
+			del self.__snapshot[key]
+		self.__snapshot.update(writes)
+		self.__pending.clear()
+		if not writes and not removes:
+			return 0
+
+		if background:
+			self.__commitThread = threading.Thread(
+				target=self.__commitInBackground,
+				args=(self.__settings.fileName(),
+					self.__settings.format(), writes, removes))
+			self.__commitThread.start()
+		else:
+			_WriteChanges(self.__settings, writes, removes)
+		log.debug('committed %d settings changes'
+			% (len(writes) + len(removes)))
+		return len(writes) + len(removes)
+
+
+	def __commitInBackground(self, fileName, settingsFormat, writes,
+	removes):
+		_WriteChanges(QtCore.QSettings(fileName, settingsFormat),
+			writes, removes)
+
+
+	def wait(self):
+		"""
+		Wait for a background commit to finish, then reload the
+		original QSettings.
+		"""
+		if self.__commitThread is not None:
+			self.__commitThread.join()
+			self.__commitThread = None
+			self.__settings.sync()
+
+
+
+class SettingsSnapshot(_KeyPrefix):
+	"""
+	A read-only copy of a group of settings, which can be read like a
+	QSettings (including with GroupGuard and ArrayReadGuard) without
+	going back to the QSettings for every key. Make one with
+	ReadSnapshot().
+	"""
+	def __init__(self, values, prefix=''):
+		_KeyPrefix.__init__(self)
+		self.__values = values
+		"""full key -> QVariant, shared with subgroup snapshots"""
+		self.__prefix = prefix
+
+
+	def subgroup(self, groupName):
+		"""Return a snapshot of a group within the current group."""
+		return SettingsSnapshot(self.__values,
+			self.__prefix + self._key(groupName) + '/')
+
+
+	def value(self, key, defaultValue=QtCore.QVariant()):
+		value = self.__values.get(self.__prefix + self._key(key))
+		if value is None:
+			return QtCore.QVariant(defaultValue)
+		return QtCore.QVariant(value)
+
+
+	def contains(self, key):
+		return self.__prefix + self._key(key) in self.__values
+
+
+	def setValue(self, key, value):
+		raise TypeError('settings snapshots are read-only')
+
+
+	def remove(self, key):
+		raise TypeError('settings snapshots are read-only')
 
 
 
+def ReadSnapshot(settings, groupName):
+	"""
+	Return a SettingsSnapshot of the group groupName within the current
+	group of settings, reading all of its keys in one pass. If settings
+	is itself a snapshot, return a view of its subgroup without reading
+	anything.
+	"""
+	if isinstance(settings, SettingsSnapshot):
+		return settings.subgroup(groupName)
+	values = {}
+	with GroupGuard(settings, groupName):
+		for key in settings.allKeys():
+			key = str(key)
+			values[key] = settings.value(key)
+	return SettingsSnapshot(values)
@@ -0,0 +1,186 @@
+"""
+Run console code in a child Python process, so that a crash or runaway
+allocation in user code does not take down the application.
+"""
+
+__all__ = [
+	'SubprocessKernel',
+]
+
+from Manifest import QtCore, QtGui, sys, os, json, signal, logging
+
+log = logging.getLogger('SubprocessKernel')
+
+KERNEL_SCRIPT = os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), 'KernelProcess.py')
+
+
+
+class SubprocessKernel(QtCore.QObject):
+	"""
+	A backend for InteractivePythonWidget which runs code in a child
+	process (see KernelProcess). The namespace lives in the child.
+
+	Signals:
+		output		text, stream name ('stdout', 'stderr' or 'context')
+		executed	source text, whether an error occurred
+	"""
+	COMPLETION_TIMEOUT_MS = 500
+
+	def __init__(self, parent=None, executable=None):
+		QtCore.QObject.__init__(self, parent)
+		self.__executable = executable or sys.executable
+		self.__process = None
+		self.__readBuffer = ''
+		self.__nextId = 0
+		self.__executing = {}
+		"""request id -> source text"""
+		self.__completions = {}
+		"""request id -> list of completions"""
+
+		QtCore.QObject.connect(QtGui.QApplication.instance(),
+			QtCore.SIGNAL('aboutToQuit()'), self.kill)
+
+
+	def isRunning(self):
+		return (self.__process is not None and self.__process.state()
+			!= QtCore.QProcess.NotRunning)
+
+
+	def start(self):
+		"""Start the child process, if it is not already running."""
+		if self.isRunning():
+			return
+		self.__readBuffer = ''
+		process = QtCore.QProcess(self)
+		QtCore.QObject.connect(process,
+			QtCore.SIGNAL('readyReadStandardOutput()'),
+			self.__readMessages)
+		QtCore.QObject.connect(process,
+			QtCore.SIGNAL('readyReadStandardError()'),
+			self.__readStderr)
+		QtCore.QObject.connect(process,
+			QtCore.SIGNAL('finished(int, QProcess::ExitStatus)'),
+			self.__processFinished)
+		self.__process = process
+		process.start(self.__executable, ['-u', KERNEL_SCRIPT])
+		log.debug('started kernel %s', KERNEL_SCRIPT)
+
+
+	def kill(self):
+		"""
+		Stop the child process. Any running or queued code is reported
+		as failed.
+		"""
+		process, self.__process = self.__process, None
+		if process is not None:
+			QtCore.QObject.disconnect(process,
+				QtCore.SIGNAL('finished(int, QProcess::ExitStatus)'),
+				self.__processFinished)
+			process.kill()
+			process.waitForFinished()
+			process.deleteLater()
+		self.__failExecuting()
+
+
+	def restart(self):
+		"""Start over with a fresh process and namespace."""
+		self.kill()
+		self.start()
+
+
+	def interrupt(self):
+		"""Raise KeyboardInterrupt in the running code, if possible."""
+		if (self.__executing and self.isRunning()
+		and hasattr(signal, 'SIGINT') and os.name == 'posix'):
+			os.kill(int(self.__process.pid()), signal.SIGINT)
+
+
+	def execute(self, sourceText, asScript=False):
+		self.start()
+		requestId = self.__send('execute', source=sourceText,
+			script=asScript)
+		self.__executing[requestId] = sourceText
+
+
+	def complete(self, text):
+		"""
+		Return completions for text, or an empty list if the child
+		does not answer within COMPLETION_TIMEOUT_MS.
+		"""
+		if not self.isRunning():
+			return []
+		requestId = self.__send('complete', text=text)
+		timer = QtCore.QTime()
+		timer.start()
+		self.__readMessages()
+		while requestId not in self.__completions:
+			remaining = self.COMPLETION_TIMEOUT_MS - timer.elapsed()
+			if (remaining <= 0
+			or not self.__process.waitForReadyRead(remaining)):
+				break
+			self.__readMessages()
+		return self.__completions.pop(requestId, [])
+
+
+	def __send(self, messageType, **message):
+		requestId = self.__nextId
+		self.__nextId += 1
+		message.update(type=messageType, id=requestId)
+		self.__process.write(json.dumps(message) + '\n')
+		return requestId
+
+
+	def __readMessages(self):
+		if self.__process is None:
+			return
+		self.__readBuffer += str(self.__process.readAllStandardOutput())
+		lines = self.__readBuffer.split('\n')
+		self.__readBuffer = lines.pop()
+		for line in lines:
+			self.__handleMessage(json.loads(line))
+
+
+	def __handleMessage(self, message):
+		messageType = message['type']
+		if messageType == 'output':
+			self.emit(QtCore.SIGNAL('output'),
+				message['text'], message['stream'])
+		elif messageType == 'executed':
+			sourceText = self.__executing.pop(message['id'], None)
+			if sourceText is not None:
+				self.emit(QtCore.SIGNAL('executed'),
+					sourceText, message['error'])
+		elif messageType == 'completions':
+			self.__completions[message['id']] = \
+				message['completions']
+		else:
+			log.warning("unknown kernel message type '%s'"
+				% messageType)
+
+
+	def __readStderr(self):
+		if self.__process is None:
+			return
+		text = str(self.__process.readAllStandardError())
+		if text:
+			self.emit(QtCore.SIGNAL('output'), text, 'stderr')
+
+
+	def __processFinished(self, exitCode, exitStatus):
+		self.__readMessages()
+		self.__readStderr()
+		self.__process.deleteLater()
+		self.__process = None
+		self.emit(QtCore.SIGNAL('output'),
+			'Kernel exited (code %d); it will restart on the next'
+			' execution.\n' % exitCode, 'stderr')
+		self.__failExecuting()
+
+
+	def __failExecuting(self):
+		executing = sorted(self.__executing.items())
+		self.__executing.clear()
+		self.__completions.clear()
+		for requestId, sourceText in executing:
+			self.emit(QtCore.SIGNAL('executed'), sourceText, True)
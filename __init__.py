@@ -1,5 +1,27 @@
-import Settings
-import Drawing
-import ResourceManager
+"""
+Submodules, and the names InteractivePythonWidget exports, are imported
+when first used, so that code which needs only (for example)
+ResourceManager starts quickly.
+"""
 
-from InteractivePythonWidget import *
+__all__ = [
+	'Settings',
+	'Drawing',
+	'ResourceManager',
+	'InteractivePythonWidget',
+	'ExecutionRecord',
+]
+
+import sys
+from LazyModule import LazyModule, ImportModule, ImportFrom
+
+sys.modules[__name__] = LazyModule(sys.modules[__name__], {
+	'Settings': ImportModule(__name__ + '.Settings'),
+	'Drawing': ImportModule(__name__ + '.Drawing'),
+	'ResourceManager': ImportModule(__name__ + '.ResourceManager'),
+
+	'InteractivePythonWidget': ImportFrom(
+		__name__ + '.InteractivePythonWidget', 'InteractivePythonWidget'),
+	'ExecutionRecord': ImportFrom(
+		__name__ + '.InteractivePythonWidget', 'ExecutionRecord'),
+})